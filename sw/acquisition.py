@@ -0,0 +1,124 @@
+import threading
+import queue
+import time
+import numpy as np
+
+
+# rate of repeated events (exponentially averaged) and duration of the last one
+class RateMeter:
+  def __init__(self, alpha=0.2):
+    self.alpha = alpha
+    self.rate = 0.0
+    self.duration = 0.0
+    self.last = None
+
+  def tick(self, duration=0.0):
+    now = time.perf_counter()
+    if self.last is not None and now > self.last:
+      self.rate = (1-self.alpha)*self.rate + self.alpha/(now - self.last) if self.rate else 1/(now - self.last)
+    self.last = now
+    self.duration = duration
+
+
+#
+# Producer thread: acquires frames through DataClass (DAQ read + envelope) off the
+# Tk event thread and puts the derived data into a bounded queue. When the queue
+# is full the oldest frame is dropped (counted in self.dropped), so consumers
+# always find the latest one.
+#
+# Frames are acquired on request (trigger) or, in live mode, continuously at a
+# target rate. The live period adapts to the measured acquisition time plus the
+# render time the consumer reports, so frames are not produced faster than shown.
+# With a demodulator (see demod.py) every frame also carries the I/Q, amplitude and
+# phase traces of the 8 ADC channels ('demod').
+#
+class AcquisitionThread(threading.Thread):
+  def __init__(self, dc, maxsize=1, demod=None):
+    super().__init__(daemon=True)
+    self.dc = dc
+    self.demod = demod
+    self.frames  = queue.Queue(maxsize)
+    self.request = threading.Event()
+    self.running = True
+    self.meter   = RateMeter()
+    self.frame_id = 0
+    self.dropped = 0
+    self.live    = False
+    self.period  = 1.0      # [s] target period in live mode
+    self.render_time = 0.0  # [s] set by the consumer
+
+  # ask for one acquisition
+  def trigger(self):
+    self.request.set()
+
+  # switch live mode on/off; rate: target frames per second
+  def set_live(self, live, rate=None):
+    if rate is not None and rate > 0:
+      self.period = 1.0/rate
+    self.live = live
+    self.request.set()
+
+  def stop(self):
+    self.running = False
+    self.request.set()
+
+  def run(self):
+    while self.running:
+      if not self.live:
+        self.request.wait()
+        self.request.clear()
+      if not self.running:
+        break
+      t0 = time.perf_counter()
+      try:
+        frame = self.acquire()
+      except Exception as e:
+        print("acquisition failed:", e)
+        continue
+      self.frame_id += 1
+      frame["id"] = self.frame_id
+      frame["t_acquire"] = time.perf_counter() - t0
+      self.meter.tick(frame["t_acquire"])
+      self.put(frame)
+      if self.live:
+        period = max(self.period, frame["t_acquire"] + self.render_time)
+        wait = period - (time.perf_counter() - t0)
+        if wait > 0:
+          self.request.wait(wait)
+          self.request.clear()
+
+  # one frame with the data the GUI panels need
+  def acquire(self):
+    with self.dc.lock:
+      data = self.dc.update()
+      env  = self.dc.envelope
+      t_read, t_process = self.dc.t_read, self.dc.t_process
+    frame = {"time": time.time(), "data": data, "envelope": env,
+             "raw": np.array(data[:,:8]), "controller": np.array(data[:1250,8:16])}
+    if self.demod is not None:
+      t0 = time.perf_counter()
+      frame["demod"] = self.demod.process(frame["raw"])
+      t_process += time.perf_counter() - t0
+    frame["t_read"], frame["t_process"] = t_read, t_process
+    return frame
+
+  def put(self, frame):
+    while True:
+      try:
+        self.frames.put_nowait(frame)
+        return
+      except queue.Full:
+        try:
+          self.frames.get_nowait()
+          self.dropped += 1
+        except queue.Empty:
+          pass
+
+  # newest frame in the queue (older ones are discarded), None if there is none
+  def latest(self):
+    frame = None
+    while True:
+      try:
+        frame = self.frames.get_nowait()
+      except queue.Empty:
+        return frame
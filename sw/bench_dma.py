@@ -0,0 +1,54 @@
+import sys
+import time
+import numpy as np
+from dev4 import dev4, DAQ_BUF_ADDR
+from include.xdma_wrapper import alloc_aligned, DAQ_CHANNELS
+
+# Read time of one DAQ buffer (DAQBUF.MEM_MULTIPLEXED_DAQ_CTRL_BUF0), all on the same buffer:
+#   read_dma:          the former DMA path: lseek + os.read into a new bytes object,
+#                      frombuffer and demultiplexing into a (samples x 16) int16 array
+#   read_daq_buffer:   preadv (read_dma_into) straight into a preallocated page aligned
+#                      (samples x 16) int16 array, which is already the demultiplexed layout
+#   read_daq_inactive: read_daq_buffer plus the status registers, the call stream_daq
+#                      makes per frame (without the xDMA device: read_sequences + copy)
+#   read_sequences:    for comparison, the mtca4u read of the GUI and DataClass
+# The first two need the xDMA device (backend xdma or sim, or mtca4u with /dev/xdma).
+#   python bench_dma.py [mtca4u|xdma|sim]
+
+backend = sys.argv[1] if len(sys.argv) > 1 else "mtca4u"
+nrep = 50
+
+d = dev4(backend=backend)
+samples = d.dma_length
+n_bytes = samples * DAQ_CHANNELS * 2
+addr = DAQ_BUF_ADDR[0]
+print("backend:", backend, "- stream_daq path:", "DMA into the slot" if d.xdma is not None else "read_sequences + copy")
+
+def timed(read):
+    t0 = time.perf_counter()
+    for r in range(nrep):
+        data = read()
+    return (time.perf_counter() - t0) / nrep, data
+
+def row(name, t, note=""):
+    print("{:18s} {:8.1f} MB/s ({:.3f} ms per buffer) {}".format(name + ":", n_bytes / t / 1e6, 1e3 * t, note).rstrip())
+
+slot = alloc_aligned(n_bytes).view(np.int16).reshape(samples, DAQ_CHANNELS)
+if d.xdma is not None and hasattr(d.xdma, "read_dma"):
+    t_old, old = timed(lambda: d.xdma.read_dma(addr, n_bytes).view(np.int16).reshape(samples, DAQ_CHANNELS).copy())
+    t_new, new = timed(lambda: d.xdma.read_daq_buffer(addr, samples, slot))
+    row("read_dma", t_old, "(+ frombuffer, demultiplex)")
+    row("read_daq_buffer", t_new, "(into the preallocated buffer), speedup {:.2f}x".format(t_old / t_new))
+    if new is not slot:
+        print("warning: read_daq_buffer did not fill the given buffer")
+    if not np.array_equal(old, new):
+        print("note: the two reads differ (DAQ running, buffer rewritten in between?)")
+else:
+    print("read_dma / read_daq_buffer: no xDMA device, skipped")
+
+t_inactive, frame = timed(lambda: d.read_daq_inactive(out=slot))
+row("read_daq_inactive", t_inactive, "(incl. status registers)")
+if frame["data"] is not slot:
+    print("warning: frame data is not the pool slot")
+t_seq, data = timed(lambda: d.device.read_sequences("DAQBUF", "DAQ_CTRL_BUF0"))
+row("read_sequences", t_seq)
@@ -0,0 +1,37 @@
+import time
+import numpy as np
+from envelope import envelope
+
+# Envelope of 8 channels x 16384 samples (one DAQ frame, synthetic IF pulses):
+# Python double loop as formerly used in gui.DataClass against envelope.py.
+
+n = 16384
+window = 100
+rng = np.random.default_rng(0)
+t = np.arange(n)
+pulse = (t > 1000) & (t < 9000)
+data = (4000 * pulse[:, None] * np.sin(2 * np.pi * 5e6 / 125e6 * t)[:, None]
+        + rng.normal(0, 50, (n, 8))).astype(np.int16)
+
+t0 = time.perf_counter()
+ref = data.copy()
+for i in range(8):
+    for k in range(1, len(data[:, i])):
+        ref[k, i] = max(data[max(0, k - window):k, i])
+t_loop = time.perf_counter() - t0
+
+nrep = 20
+t0 = time.perf_counter()
+for r in range(nrep):
+    env = envelope(data, window)
+t_max = (time.perf_counter() - t0) / nrep
+
+t0 = time.perf_counter()
+for r in range(nrep):
+    envelope(data, mode="hilbert")
+t_hil = (time.perf_counter() - t0) / nrep
+
+print("identical to loop:  ", np.array_equal(env, ref))
+print("python loop:         {:10.2f} ms".format(1e3 * t_loop))
+print("running max:         {:10.2f} ms ({:.0f} x faster)".format(1e3 * t_max, t_loop / t_max))
+print("hilbert magnitude:   {:10.2f} ms".format(1e3 * t_hil))
@@ -0,0 +1,61 @@
+import time
+import numpy as np
+import doFFT
+
+# Amplitude/phase of a 700-sample window (as analysed per channel in SweepClass):
+# full FFT + argmax (getAP) against the single-bin DFT at the known IF, with and
+# without frequency refinement; accuracy on synthetic pulses with noise.
+
+ts = 8e-9
+f_if = 5e6
+N = 700
+n = np.arange(N)
+rng = np.random.default_rng(0)
+
+fft = doFFT.doFFTClass(ts)
+dft = doFFT.doFFTClass(ts, freq=f_if)
+ref = doFFT.doFFTClass(ts, freq=f_if, refine=True)
+
+def pulse(freq, amp, pha, noise=20.0):
+    return (amp * np.cos(2 * np.pi * freq * ts * n + np.deg2rad(pha)) + 100
+            + rng.normal(0, noise, N)).astype(np.int16)
+
+# accuracy: on the IF bin and off the bin (frequency error up to +-0.4 bin)
+print("{:>12s} {:>10s} {:>22s} {:>22s} {:>22s}".format("df[kHz]", "", "fft", "dft", "dft+refine"))
+for df in (0.0, 20e3, -50e3, 70e3):
+    errors = {}
+    for name, est in (("fft", fft), ("dft", dft), ("dft+refine", ref)):
+        ea, ep = [], []
+        for k in range(200):
+            amp, pha = rng.uniform(500, 8000), rng.uniform(-180, 180)
+            freq, a, p = est.getAP(pulse(f_if + df, amp, pha))
+            ea.append(a / amp - 1)
+            ep.append((p - pha + 180) % 360 - 180)
+        errors[name] = "amp {:6.2f}% pha {:5.2f}".format(100 * np.max(np.abs(ea)), np.max(np.abs(ep)))
+    print("{:12.0f} {:>10s} {:>22s} {:>22s} {:>22s}".format(df / 1e3, "max err", errors["fft"], errors["dft"], errors["dft+refine"]))
+
+# speed: one window per call, and a batch of 1000 windows in one call
+s = pulse(f_if, 4000, 30)
+batch = np.array([pulse(f_if, 4000, 30) for k in range(1000)])
+nrep = 2000
+for name, est in (("fft", fft), ("dft", dft), ("dft+refine", ref)):
+    est.getAP(s)
+    t0 = time.perf_counter()
+    for r in range(nrep):
+        est.getAP(s)
+    dt = (time.perf_counter() - t0) / nrep
+    print("{:12s} {:8.1f} us per window".format(name, 1e6 * dt))
+
+t0 = time.perf_counter()
+for r in range(10):
+    dft.getAP_dft(batch)
+print("{:12s} {:8.2f} us per window (batch of {})".format("dft batch", 1e6 * (time.perf_counter() - t0) / 10 / len(batch), len(batch)))
+
+# full FFT of the batch (real FFT in the reused workspace), single-threaded and on all cores
+for workers in (None, -1):
+    est = doFFT.doFFTClass(ts, workers=workers)
+    est.getAP_batch(batch)
+    t0 = time.perf_counter()
+    for r in range(10):
+        est.getAP_batch(batch)
+    print("{:12s} {:8.2f} us per window (batch of {}, workers={})".format("fft batch", 1e6 * (time.perf_counter() - t0) / 10 / len(batch), len(batch), workers))
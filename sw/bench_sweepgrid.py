@@ -0,0 +1,48 @@
+import sys
+import numpy as np
+from sweepgrid import SweepAxis, SweepGrid
+
+# Number of acquisitions of a power level x Vdd sweep: dense grid against a coarse
+# grid with adaptive refinement of the power level (SweepClass.run_sweep with
+# refine_tol), on the amplifier model of include/sim.py (tanh AM/AM, AM/PM).
+# Also the largest error of the refined curves, linearly interpolated, against
+# the dense grid.
+#   python bench_sweepgrid.py [AMP PHA]   (refinement tolerances of ad and pd)
+
+tol = {'ad': 200.0, 'pd': 1.0}
+if len(sys.argv) == 3:
+  tol = {'ad': float(sys.argv[1]), 'pd': float(sys.argv[2])}
+vdds = np.linspace(7, 32, num=6)
+
+def amplifier(level, Vdd):
+  # input level [LSB] -> amplitude difference out - in, phase difference [deg]
+  sat = 12000.0 * Vdd / 32.0
+  out = sat * np.tanh(4.0 * level / 8.0 / sat)
+  return {'ad': out - level / 8.0, 'pd': (20.0 * (out / sat)**2) % 360.0}
+
+def sweep(step, refine):
+  state = {}
+  def set_supply(Vdd):
+    state['Vdd'] = Vdd
+  def set_level(Powerlevel):
+    state['Powerlevel'] = Powerlevel
+  axes = [SweepAxis('Vdd', vdds, set_supply, cost=1.0),
+          SweepAxis('Powerlevel', list(range(1000, 30_001, step)), set_level, cost=0.01)]
+  grid = SweepGrid(axes, refine='Powerlevel' if refine else None, tolerances=tol,
+                   periods={'pd': 360.0}, min_step=100)
+  results = grid.run(lambda t, point: amplifier(state['Powerlevel'], state['Vdd']))
+  return grid, results
+
+dense, dense_results = sweep(100, False)
+coarse, coarse_results = sweep(1000, True)
+print("dense grid (step 100):          ", sum(dense.passes), "acquisitions")
+print("coarse grid (step 1000) refined:", sum(coarse.passes), "acquisitions, passes:", coarse.passes)
+
+err = {'ad': 0.0, 'pd': 0.0}
+for Vdd in vdds:
+  ref = sorted((p['Powerlevel'], r) for p, r in dense_results if p['Vdd'] == Vdd)
+  got = sorted((p['Powerlevel'], r) for p, r in coarse_results if p['Vdd'] == Vdd)
+  for k in err:
+    y = np.interp([x for x, r in ref], [x for x, r in got], [r[k] for x, r in got])
+    err[k] = max(err[k], np.max(np.abs(y - [r[k] for x, r in ref])))
+print("max. interpolation error: ad {:.1f}, pd {:.2f} deg (tolerances {}, {})".format(err['ad'], err['pd'], tol['ad'], tol['pd']))
@@ -0,0 +1,31 @@
+import time
+import numpy as np
+from dev4 import dev4
+
+# Compares the upload time of one 1024-word table (APP.FFD_I):
+# element-wise writes (previous implementation, without its trailing sleep)
+# against the block transfer of dev4.write_table (incl. readback verification).
+
+nrep = 5
+d = dev4()
+table = np.zeros(1024)
+table[1:790] = 1024
+table[790:800] = -1024
+
+t_loop = []
+t_bulk = []
+for r in range(nrep):
+    t0 = time.perf_counter()
+    for i in range(1024):
+        d.device.write("APP", "FFD_I", table[i], i)
+    t_loop.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    ok = d.write_table("APP", "FFD_I", table)
+    t_bulk.append(time.perf_counter() - t0)
+    if not ok:
+        print("readback verification failed in repetition", r)
+
+print("element-wise upload: {:8.2f} ms per table".format(1e3 * np.median(t_loop)))
+print("block upload:        {:8.2f} ms per table (verified)".format(1e3 * np.median(t_bulk)))
+print("speed-up:            {:8.1f} x".format(np.median(t_loop) / np.median(t_bulk)))
@@ -0,0 +1,98 @@
+import time
+t_start = time.perf_counter()
+
+import argparse
+import numpy as np
+
+from dev4 import dev4
+from setPowerSupply import setPowerSupplyClass
+from measurement import SweepClass, DataClass, RefClass, FfdClass
+
+#
+# Headless sweeps and captures without the Tk GUI, e.g.
+#   python cli.py sweep --start 1000 --stop 30000 --step 1000 --vdd 7 32 5
+#   python cli.py sweep --step 4000 --refine 0.5 2.0 --resume
+#   python cli.py capture -n 10 -o results/ch.npz
+#   python cli.py --backend sim sweep --step 500     (no hardware needed)
+#
+
+
+# values of a sweep axis: one value, or start stop num as for np.linspace
+def axis_values(v):
+  if v is None or len(v) == 1:
+    return v
+  if len(v) == 3:
+    return np.linspace(v[0], v[1], num=int(v[2]))
+  raise ValueError("axis: expected one value or start stop num, got " + str(v))
+
+
+def sweep(args, d, dc):
+  if args.backend == "sim":
+    from include.sim import sim_supply
+    ps = setPowerSupplyClass(client=sim_supply(d.xdma))
+  else:
+    ps = setPowerSupplyClass()
+  ps.setVddVgg1Vgg2(Vdd=0.0, Vgg1=0.0, Vgg2=0.0)
+  rc = RefClass(d)
+  fc = FfdClass(d)
+  sw = SweepClass(args.start, args.stop, args.step, dc, fc, ps, rc)
+  sw.filename = args.output
+  sw.store_traces = not args.no_traces
+  sw.vdds  = axis_values(args.vdd)
+  sw.vgg1s = axis_values(args.vgg1)
+  sw.vgg2s = axis_values(args.vgg2)
+  sw.ref_levels = axis_values(args.ref_level)
+  sw.att_vals   = args.att
+  if args.refine is not None:
+    sw.refine_tol = {'ad': args.refine[0], 'pd': args.refine[1]}
+    sw.min_step   = args.min_step
+  sw.run_sweep(resume=args.resume)
+
+
+def capture(args, d, dc):
+  frames = []
+  t0 = time.perf_counter()
+  for i in range(args.n):
+    frames.append(dc.update().copy())
+  print("captured", args.n, "frames in {:.3f} s".format(time.perf_counter() - t0))
+  np.savez_compressed(args.output, a=np.array(frames))
+
+
+parser = argparse.ArgumentParser(description="dev4 sweeps and captures without the GUI")
+parser.add_argument("--backend", default="mtca4u", choices=["mtca4u", "xdma", "sim"],
+                    help="device backend; sim: simulated board and power supply")
+parser.add_argument("--no-init", action="store_true", help="skip init_board()")
+parser.add_argument("--warm", action="store_true",
+                    help="skip init_board() if the board is still configured (SPI state assumed)")
+sub = parser.add_subparsers(dest="command", required=True)
+
+p = sub.add_parser("sweep", help="power level / supply sweep")
+p.add_argument("--start", type=int, default=1000)
+p.add_argument("--stop",  type=int, default=30_000)
+p.add_argument("--step",  type=int, default=10000)
+p.add_argument("--vdd",  type=float, nargs="+", default=[32.0], help="value or start stop num")
+p.add_argument("--vgg1", type=float, nargs="+", default=[2.2], help="value or start stop num")
+p.add_argument("--vgg2", type=float, nargs="+", default=[1.8], help="value or start stop num")
+p.add_argument("--ref-level", type=float, nargs="+", help="sweep the REF level as well")
+p.add_argument("--att", type=int, nargs="+", help="sweep RTM ATT_VAL over these values as well")
+p.add_argument("--refine", type=float, nargs=2, metavar=("AMP", "PHA"),
+               help="refine the power level where amplitude/phase differences change more")
+p.add_argument("--min-step", type=int, default=100, help="smallest power level step of the refinement")
+p.add_argument("--resume", action="store_true", help="continue an interrupted sweep")
+p.add_argument("--no-traces", action="store_true", help="store the scalars only")
+p.add_argument("-o", "--output", default="results/sweep.npz")
+p.set_defaults(func=sweep)
+
+p = sub.add_parser("capture", help="read DAQ frames")
+p.add_argument("-n", type=int, default=1, help="number of frames")
+p.add_argument("-o", "--output", default="results/ch.npz")
+p.set_defaults(func=capture)
+
+args = parser.parse_args()
+print("startup: {:.0f} ms".format(1e3*(time.perf_counter() - t_start)))
+
+d = dev4(backend=args.backend)
+if not args.no_init:
+  d.init_board(warm=args.warm)
+dc = DataClass(d)
+args.func(args, d, dc)
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+# Min/max decimation of the columns of y (samples x channels) for display on n_px
+# pixel columns: every bucket of samples is replaced by its minimum and maximum,
+# so spikes and pulse edges stay visible. Returns x (sample index of the points)
+# and the decimated (2*buckets x channels) array; short signals are returned as is.
+def minmax_decimate(y, n_px=900):
+  y = np.asarray(y)
+  n = y.shape[0]
+  if n <= 2*n_px:
+    return np.arange(n), y
+  bucket = -(-n // n_px)
+  nb = -(-n // bucket)
+  if nb*bucket != n:  # pad the last bucket with its last sample
+    y = np.concatenate([y, np.repeat(y[-1:], nb*bucket - n, axis=0)])
+  blocks = y.reshape((nb, bucket) + y.shape[1:])
+  out = np.empty((2*nb,) + y.shape[1:], dtype=y.dtype)
+  out[0::2] = blocks.min(axis=1)
+  out[1::2] = blocks.max(axis=1)
+  x = np.empty(2*nb, dtype=np.int64)
+  x[0::2] = np.arange(nb)*bucket
+  x[1::2] = np.minimum(np.arange(nb)*bucket + bucket - 1, n - 1)
+  return x, out
+
+
+#
+# Decimated views of the traces of one frame, computed once per frame and kept
+# until a frame with another id is requested.
+#
+class Decimator:
+  def __init__(self, n_px=900):
+    self.n_px = n_px
+    self.frame_id = None
+    self.cache = {}
+
+  def get(self, frame, name):
+    if frame["id"] != self.frame_id:
+      self.frame_id = frame["id"]
+      self.cache = {}
+    if name not in self.cache:
+      self.cache[name] = minmax_decimate(frame[name], self.n_px)
+    return self.cache[name]
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+# number of samples holding a whole number of IF periods (at most max_n), i.e. the
+# decimation for which the moving average removes the 2*IF mixing product exactly;
+# 25 for 5 MHz at 125 MS/s
+def if_period_samples(if_freq, ts, max_n=1000):
+  for n in range(1, max_n + 1):
+    cycles = n * if_freq * ts
+    if abs(cycles - round(cycles)) < 1e-9 and round(cycles) > 0:
+      return n
+  return max(1, int(round(1.0 / (if_freq * ts))))
+
+
+#
+# Digital I/Q demodulation of IF channels (non-IQ sampling) for all channels of a frame
+# at once: mixing with precomputed LO tables, moving-average decimation over
+# `decimation` samples (a whole number of IF periods by default, which cancels DC and
+# the 2*IF product) and rotation by a complex calibration factor per channel.
+# order > 1 adds moving averages before the decimation (a CIC filter of that order)
+# for more image rejection when the decimation is not a whole number of IF periods;
+# each of them delays the traces by (decimation-1)/2 samples, which t accounts for,
+# and the first order-1 blocks (no full window yet) are dropped.
+# process() returns decimated traces (blocks x channels): time t [s] of the block
+# centres, i, q, amplitude amp and phase pha [deg]; amplitude in the units of the
+# input (IF amplitude), as getAP.
+#
+class Demodulator:
+  def __init__(self, ts=8e-9, if_freq=5e6, decimation=None, order=1, rotation=None):
+    self.ts = ts
+    self.if_freq = if_freq
+    self.decimation = decimation or if_period_samples(if_freq, ts)
+    self.order = order
+    self.rotation = rotation  # complex factor per channel, None: no rotation
+    self.lo = {}              # number of samples -> (2 x samples) cos/-sin table
+
+  def lo_table(self, n):
+    if n not in self.lo:
+      w = 2 * np.pi * self.if_freq * self.ts * np.arange(n)
+      self.lo[n] = (2.0 / self.decimation) * np.array([np.cos(w), -np.sin(w)])
+    return self.lo[n]
+
+  def process(self, data):
+    data = np.asarray(data)
+    if data.ndim == 1:
+      data = data[:, None]
+    m = self.decimation
+    nb = data.shape[0] // m
+    if self.order == 1:
+      # mixing and block average in one product: the LO is periodic in m samples
+      # whenever m is a whole number of IF periods
+      blocks = data[:nb*m].reshape(nb, m, -1)
+      cycles = m * self.if_freq * self.ts
+      if abs(cycles - round(cycles)) < 1e-9:
+        iq = np.einsum("kn,bnc->kbc", self.lo_table(m), blocks, optimize=True)
+      else:
+        lo = self.lo_table(nb*m).reshape(2, nb, m)
+        iq = np.einsum("kbn,bnc->kbc", lo, blocks, optimize=True)
+    else:
+      n = data.shape[0]
+      mixed = self.lo_table(n)[:, :, None] * data[None, :, :]
+      for k in range(self.order - 1):
+        c = np.cumsum(mixed, axis=1)
+        c[:, m:] = c[:, m:] - c[:, :-m]
+        mixed = c / m
+      iq = mixed[:, :nb*m].reshape(2, nb, m, -1).sum(axis=2)
+    # blocks ramping up through the cascade are dropped; the delay of the cascade
+    # is taken off the block centres
+    first = min(self.order - 1, nb)
+    z = iq[0, first:] + 1j * iq[1, first:]
+    if self.rotation is not None:
+      z = z * np.asarray(self.rotation)
+    delay = (self.order - 1) * (m - 1) / 2.0
+    t = (np.arange(first, nb) * m + (m - 1) / 2.0 - delay) * self.ts
+    return {"t": t, "i": z.real, "q": z.imag, "amp": np.abs(z), "pha": np.angle(z, deg=True)}
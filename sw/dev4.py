@@ -1,25 +1,108 @@
 #!/usr/bin/python3
-import mtca4u
 import numpy as np
 import time
 import datetime
 import os
+import threading
+import collections
+import contextlib
+from include.xdma_wrapper import xdma_wrapper, alloc_aligned, DAQ_CHANNELS
+from include.mapfile import register_map, mapped_device
 
 # outdated version: active one on the COMex
 
-class dev4:
-    def __init__(self):
+# Registers which start a transaction in the firmware (SPI to the AD9510 / AD9268).
+# After such a write, the given busy flag is polled before the next access.
+BUSY_REGISTERS = {
+    ("BSP", "AREA_SPI_DIV"): "SPI_DIV_BUSY",
+    ("BSP", "AREA_SPI_ADC"): "SPI_ADC_BUSY",
+}
+
+# DMA addresses of DAQBUF.MEM_MULTIPLEXED_DAQ_CTRL_BUF0/1 (ch13.mapp)
+DAQ_BUF_ADDR = [0x80000000, 0x80100000]
+
+# kinds of steps in the initialisation sequence (see dev4.init_sequence)
+CFG = "cfg"
+WO = "wo"
+ACT = "act"
+BARRIER = "barrier"
+
+# Registers with a side effect on every write (SPI transactions, strobes). The shadow
+# cache remembers their last value but never skips a write to them.
+ACTION_REGISTERS = {
+    ("BSP", "AREA_SPI_DIV"), ("BSP", "AREA_SPI_ADC"), ("BSP", "DAC_IDELAY_INC"),
+    ("TIMING", "MANUAL_TRG"), ("DAQ", "TIMESTAMP_RST"),
+}
+# Writing these registers resets the firmware module, i.e. invalidates its shadow entries
+RESET_REGISTERS = {
+    ("BSP", "RESET_N"): "BSP",
+}
+
+# Preallocated DAQ buffers of one stream_daq generator: the free slots, the condition
+# the producer waits on for a released slot and the totals of the stream (stats).
+# Frames carry their pool ('pool'), so a slot always goes back to the stream it was
+# taken from, also with several streams or after a restart.
+class DaqPool:
+    def __init__(self, size, samples):
+        self.cond = threading.Condition()
+        self.free = collections.deque(range(size))
+        self.stats = {"frames": 0, "missed": 0, "torn": 0, "waits": 0, "timeouts": 0}
+        frame_bytes = samples * DAQ_CHANNELS * 2
+        self.buffers = alloc_aligned(size * frame_bytes).view(np.int16).reshape(size, samples, DAQ_CHANNELS)
+
+    # index of a free slot; waits up to timeout [s] for one to be released, None if none was
+    def take(self, timeout):
+        with self.cond:
+            if not self.free:
+                self.stats["waits"] += 1
+            if not self.cond.wait_for(lambda: self.free, timeout):
+                return None
+            return self.free.popleft()
+
+    def release(self, slot):
+        with self.cond:
+            if slot not in self.free:
+                self.free.append(slot)
+            self.cond.notify()
 
-        # creat .dmap file
-        if not os.path.exists("./include/mapfile.dmap"):
-            os.mknod("./include/mapfile.dmap")
-            with open("./include/mapfile.dmap", "w") as dmap_file:
-              dmap_file.write("device_reg" + " (xdma:xdma/slot" + str(6) + "?map=./include/ch13.mapp" + ")\n")
 
-        # Creating device entry using the mtca4u library
-        # based on DESY's ChimeraTK (see: https://chimeratk.github.io/DeviceAccess-PythonBindings/).
-        mtca4u.set_dmap_location("./include/mapfile.dmap")
-        self.device = mtca4u.Device("device_reg")
+class dev4:
+    # backend: "mtca4u" (ChimeraTK), "xdma" (mapfile + xdma_wrapper, no ChimeraTK needed)
+    # or "sim" (simulated board, see include/sim.py)
+    # dma: with the mtca4u backend, also open the xDMA device for interrupts and for DMA
+    # reads of the DAQ buffers straight into the caller's array (see read_daq_inactive)
+    def __init__(self, shadow=False, backend="mtca4u", dma=True):
+        self.slot = 6
+
+        # raw xDMA access (interrupts, DMA reads), None if not available
+        self.xdma = None
+        self.irq_enabled = set()
+
+        if backend == "xdma":
+            self.xdma = xdma_wrapper(self.slot)
+            self.device = mapped_device(register_map("./include/ch13.mapp"), self.xdma)
+        elif backend == "sim":
+            from include.sim import sim_xdma
+            regmap = register_map("./include/ch13.mapp")
+            self.xdma = sim_xdma(regmap)
+            self.device = mapped_device(regmap, self.xdma)
+        else:
+            # creat .dmap file
+            if not os.path.exists("./include/mapfile.dmap"):
+                os.mknod("./include/mapfile.dmap")
+                with open("./include/mapfile.dmap", "w") as dmap_file:
+                  dmap_file.write("device_reg" + " (xdma:xdma/slot" + str(self.slot) + "?map=./include/ch13.mapp" + ")\n")
+
+            # Creating device entry using the mtca4u library
+            # based on DESY's ChimeraTK (see: https://chimeratk.github.io/DeviceAccess-PythonBindings/).
+            import mtca4u
+            mtca4u.set_dmap_location("./include/mapfile.dmap")
+            self.device = mtca4u.Device("device_reg")
+            if dma:
+                try:
+                    self.xdma = xdma_wrapper(self.slot)
+                except OSError as e:
+                    print("*** xDMA device not available, DAQ buffers are read through mtca4u:", e)
 
         self.app_clk_freq = 125_000_000
         self.trigger_rate = 0.1
@@ -28,137 +111,50 @@ class dev4:
         self.ad9510_input = 0  # '1' for internal quarz, '2' for external clock
         self.ad9510_division = 1
         self.daq_strobe_div = 1
+        self.daq_irq_channel = 0   # xDMA event channel of the DAQ 'buffer done' interrupt
+
+        # write engine: queued writes of one module, flushed as a batch
+        self.batching = False
+        self.queue_module = None
+        self.write_queue = []
+        self.poll_timeout = 1.0   # [s] maximum time to wait on a busy/status register
+        self.poll_delay = 20e-6   # [s] first pause between two polls, doubled up to poll_max_delay
+        self.poll_max_delay = 1e-3
+        self.busy_min_delay = 50e-6  # [s] a busy flag never seen set counts as done only after this
+        self.pulse_width = 0.01   # [s] hold of the reset/power pulses of the init sequence (the former pause per write)
+        self.write_stats = {}     # (module, register) -> [count, total time, max time]
+
+        # optional write-through shadow cache: (module, register, idx) -> last written value
+        self.shadow = {} if shadow else None
+        self.shadow_hits = 0
+        self.shadow_misses = 0
 
 
     #  Initialize modules BSP, RTM, TIMING, DAQ, APP by writing registers
     #
     # For a complete description of the set options, see
     # the accompagnying documentation (file: FWK_documentation_desy_march2022.pdf, chapter 6).
-    def init_board(self):
-
-        # ---- Set stage ----------------------------
-        self.device_write("BSP", "CLK_SEL", 0) # just for initial stage
-        self.device_write("BSP", "RESET_N", 0) # reset BSP
-        self.device_write("BSP", "RESET_N", 1) # power on again
-
-        # ---- Initialize RTM --------------------------
-        self.device_write("RTM", "RF_PERMIT", 1)   # namechange in v2.0.0!
-        #self.device_write("RTM", "DACAB", 870)     # namechange in v2.0.0!
-        self.device_write("RTM", "DACAB", 570)     # namechange in v2.0.0!
-        self.device_write("BSP", "ADC_REVERT_CLK", 0x18)
-        #self.device_write("BSP", "ADC_REVERT_CLK", 0x10)
-        #### changes according to CLK input
-
-        # ---- Reset and Program AD9510s ('Clock dividers' driving ADCs) -----------------
-        # see Datasheet AD9510, pp. 44 for the meaning of the registers
-        #
-        self.device_write("BSP", "AREA_SPI_DIV", 0x00, 0x58) # register 0x58 to 0x00
-        self.device_write("BSP", "AREA_SPI_DIV", 0x01, 0x5A) # update all
-
-        # ---- Reset SIS8300ku -----------------------------
-        self.device_write("BSP", "CLK_RST", 1) # reset
-        self.device_write("BSP", "CLK_RST", 0) # power on again
-
-
-
-        # ---- Set MUX clock to RTM(CLK2) -------------------------------
-        #        self.device_write("BSP", "CLK_MUX", [3, 3, 0, 0, 0, 0]) # on-board 125MHz Quartz
-        self.device_write("BSP", "CLK_MUX", [0, 0, 0, 0, 0, 0]) # on-board 125MHz Quartz
-        # self.device_write("BSP", "CLK_MUX", [0, 0, 1, 1, 1, 0]) # external R&S via SMA on faceplate sis8300ku
-
-        self.device_write("BSP", "AREA_SPI_DIV", self.ad9510_input, 0x45)
-                            # Selecting which CLK input will be used to distribute
-                            # 0 -> PLL uses clock coming from RTM(CLK2)    1 -> PLL uses clock coming from Muxes(CLK1)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x43, 0x0A)
-                            # set N divider to 0x43 = bit: 0100 0011
-
-        # All output voltage levels (LVPECL) are set to 660mV
-        # 0x0c = bit: 0000 1100
-        self.device_write("BSP", "AREA_SPI_DIV", 0x0C, 0x3C)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x0C, 0x3D)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x0C, 0x3E)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x0C, 0x3F)
-
-        # Output Current Level = 3.5mA Termination 100ohms Output Type = LVDS
-        # 0x02 = bit: 0000 0010
-        self.device_write("BSP", "AREA_SPI_DIV", 2, 0x40)
-        self.device_write("BSP", "AREA_SPI_DIV", 2, 0x41)
-        self.device_write("BSP", "AREA_SPI_DIV", 2, 0x42)
-        self.device_write("BSP", "AREA_SPI_DIV", 2, 0x43)
-
-        # Bypass and power down divider logic; route clock directly to output
-        # We have that  ad9510_division = 2
-        self.device_write("BSP", "AREA_SPI_DIV", 0x00, 0x49)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x00, 0x4B)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x00, 0x4D)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x00, 0x4F)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x00, 0x51)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x00, 0x53)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x00, 0x55)
-        self.device_write("BSP", "AREA_SPI_DIV", 0x00, 0x57)
-
-        self.device_write("BSP", "AREA_SPI_DIV", 0x20, 0x58) # registeer 0x58 to 0x20
-        self.device_write("BSP", "AREA_SPI_DIV", 1, 0x5A) # update all
-        time.sleep(1)
-
-        # -------------------------------------------------------
-        self.device_write("BSP", "CLK_RST", 1) # reset clock
-        self.device_write("BSP", "CLK_RST", 0) # power-on again
-
-        self.check_clk()
-
-
-        # ---- Enable CLKs again ----------------------------------
-        self.device_write("BSP", "CLK_SEL", 1) # 1: 125MHz internal crystal 0:CLK05 extern clock
-        self.device_write("BSP", "RESET_N", 0)
-        self.device_write("BSP", "RESET_N", 1)
-
-
-        # ---- Initialise ADCs -------------------------------------
-        # See address map of ADC (AD9268 chip),
-        # manual AD9268, p. 37
-        self.device_write("BSP", "ADC_REVERT_CLK", 0x18)
-
-        self.device_write("BSP", "AREA_SPI_ADC", 0x3C, 0x00) # 0x3c = bits: 0011 1100
-        self.device_write("BSP", "AREA_SPI_ADC", 0x41, 0x14) # 0x41 = bits: 0100 0001
-        self.device_write("BSP", "AREA_SPI_ADC", 0x00, 0x0D) # 0x00 = bits: 0000 0000
-        self.device_write("BSP", "AREA_SPI_ADC", 0x01, 0xFF) #  setting transfer bit
-
-        self.device_write("BSP", "ADC_ENA", 0) # power off
-        self.device_write("BSP", "ADC_ENA", 1) # power on
-        self.device_write("BSP", "DAC_ENA", 1)
-
-
-        # ---- Initialize trigger channels Ch0 & Ch1 -------------------------------
-        self.device_write("TIMING", "SOURCE_SEL", 0, 0)  # DAQ trigger will be sourced from application clock (125MHz)
-        self.device_write("TIMING", "SOURCE_SEL", 0, 1)  # DPM DAC Table strobe will be sourced from application clock (125MHz)
-        self.device_write("TIMING", "SOURCE_SEL", 10, 2)  
-
-        self.device_write("TIMING", "SYNC_SEL", 1, 1)    # DPM DAC Table strobe will be synced with DAQ Trigger
-        self.device_write("TIMING", "DIVIDER_VALUE", self.app_clk_freq * self.trigger_rate - 1, 0)
-        self.device_write("TIMING", "DIVIDER_VALUE", 0, 1)
-
-        self.device_write("TIMING", "ENABLE", 7)  # Enable Trigger Channel
-
-        self.device_write("APP", "DPM_MODE", 1)
-        self.device_write("APP", "MLVDS_OE", 0x60)  # Output Enable
-        self.device_write("APP", "MLVDS_O", 0x60)   # Output Value
-
-        # Initialise the strobe signal of the DAQ
-        self.device_write("DAQ", "SAMPLES", self.dma_length, 0)
-        self.device_write("DAQ", "STROBE_DIV", self.daq_strobe_div-1, 0)   # strobe DAQ = clk / xxx # originally set to 99
-        self.device_write("DAQ", "TAB_SEL", 0, 0)      # Choose raw adc signals on mux
-        self.device_write("DAQ", "DOUBLE_BUF_ENA", 1, 0)  # Enable double buffering for Region 0
-        self.device_write("DAQ", "ENABLE", 1, 0)       # Enable DAQ1 for now.
-
-        # ---- Initialise attenuators on the RTM ----------------
-        self.device_write("RTM", "ATT_SEL", 255)
-        self.device_write("RTM", "ATT_VAL", 63)
-        ############ The end ####################################
-
-
-
-        compilation_unix_time = self.device.read("BSP", "PRJ_TIMESTAMP")
+    #
+    # The sequence itself is the data table of init_sequence(). CFG registers which
+    # already hold their value are not written again, the SPI transactions (WO) are
+    # always sent. force replays every step and drops the shadow cache.
+    # warm (opt-in) skips the whole sequence if all CFG registers hold their final value
+    # and the clock is fine; the AD9510/AD9268 state set over SPI cannot be read back,
+    # so it is then assumed unchanged since the last init (no power cycle in between).
+    def init_board(self, force=False, warm=False):
+        t_start = time.perf_counter()
+        self.reset_write_stats()
+        seq = self.init_sequence()
+        if warm and not force and self.sequence_applied(seq):
+            print("init_board: board already configured ({:.3f} s)".format(time.perf_counter() - t_start))
+        else:
+            if force:
+                self.invalidate()
+            n_skipped = self.run_sequence(seq, diff=not force)
+            n_writes = sum(st[0] for st in self.write_stats.values())
+            print("init_board: {} writes, {} skipped in {:.3f} s".format(n_writes, n_skipped, time.perf_counter() - t_start))
+
+        compilation_unix_time = self.device.read("BSP", "PRJ_TIMESTAMP", 1, 0)[0]
         print(
             "This firmware was compiled on:",
             datetime.datetime.fromtimestamp(int(compilation_unix_time)).strftime(
@@ -166,11 +162,394 @@ class dev4:
             ),
         )
 
-    # simple relay function with an extra sleep command to ensure that the register is written when done
+    # Board initialisation as a data table, executed in this order by run_sequence().
+    # Steps are (module, register, value, idx, kind) with kind
+    #   CFG: configuration register; read back and skipped if it already holds the value
+    #   WO:  transaction register (SPI areas), cannot be read back, always written
+    #   ACT: reset/strobe, always written
+    # and (BARRIER, method): flush and wait for the hardware condition checked by dev4.<method>.
+    # The reset and power pulses are held for pulse_width (hold_pulse) on both edges, as the
+    # former pause after every write did; back to back they would last two bus writes only.
+    def init_sequence(self):
+        return [
+            # ---- Set stage ----------------------------
+            ("BSP", "CLK_SEL", 0, 0, CFG),         # just for initial stage
+            ("BSP", "RESET_N", 0, 0, ACT),         # reset BSP
+            (BARRIER, "hold_pulse"),
+            ("BSP", "RESET_N", 1, 0, ACT),         # power on again
+            (BARRIER, "hold_pulse"),
+
+            # ---- Initialize RTM --------------------------
+            ("RTM", "RF_PERMIT", 1, 0, CFG),       # namechange in v2.0.0!
+            #("RTM", "DACAB", 870, 0, CFG),        # namechange in v2.0.0!
+            ("RTM", "DACAB", 570, 0, CFG),         # namechange in v2.0.0!
+            ("BSP", "ADC_REVERT_CLK", 0x18, 0, CFG),
+            #("BSP", "ADC_REVERT_CLK", 0x10, 0, CFG),
+            #### changes according to CLK input
+
+            # ---- Reset and Program AD9510s ('Clock dividers' driving ADCs) -----------------
+            # see Datasheet AD9510, pp. 44 for the meaning of the registers
+            ("BSP", "AREA_SPI_DIV", 0x00, 0x58, WO),  # register 0x58 to 0x00
+            ("BSP", "AREA_SPI_DIV", 0x01, 0x5A, WO),  # update all
+
+            # ---- Reset SIS8300ku -----------------------------
+            ("BSP", "CLK_RST", 1, 0, ACT),         # reset
+            (BARRIER, "hold_pulse"),
+            ("BSP", "CLK_RST", 0, 0, ACT),         # power on again
+            (BARRIER, "hold_pulse"),
+
+            # ---- Set MUX clock to RTM(CLK2) -------------------------------
+            #("BSP", "CLK_MUX", [3, 3, 0, 0, 0, 0], 0, CFG), # on-board 125MHz Quartz
+            ("BSP", "CLK_MUX", [0, 0, 0, 0, 0, 0], 0, CFG),  # on-board 125MHz Quartz
+            #("BSP", "CLK_MUX", [0, 0, 1, 1, 1, 0], 0, CFG), # external R&S via SMA on faceplate sis8300ku
+
+            # Selecting which CLK input will be used to distribute
+            # 0 -> PLL uses clock coming from RTM(CLK2)    1 -> PLL uses clock coming from Muxes(CLK1)
+            ("BSP", "AREA_SPI_DIV", self.ad9510_input, 0x45, WO),
+            ("BSP", "AREA_SPI_DIV", 0x43, 0x0A, WO),  # set N divider to 0x43 = bit: 0100 0011
+
+            # All output voltage levels (LVPECL) are set to 660mV
+            # 0x0c = bit: 0000 1100
+            ("BSP", "AREA_SPI_DIV", 0x0C, 0x3C, WO),
+            ("BSP", "AREA_SPI_DIV", 0x0C, 0x3D, WO),
+            ("BSP", "AREA_SPI_DIV", 0x0C, 0x3E, WO),
+            ("BSP", "AREA_SPI_DIV", 0x0C, 0x3F, WO),
+
+            # Output Current Level = 3.5mA Termination 100ohms Output Type = LVDS
+            # 0x02 = bit: 0000 0010
+            ("BSP", "AREA_SPI_DIV", 2, 0x40, WO),
+            ("BSP", "AREA_SPI_DIV", 2, 0x41, WO),
+            ("BSP", "AREA_SPI_DIV", 2, 0x42, WO),
+            ("BSP", "AREA_SPI_DIV", 2, 0x43, WO),
+
+            # Bypass and power down divider logic; route clock directly to output
+            # We have that  ad9510_division = 2
+            ("BSP", "AREA_SPI_DIV", 0x00, 0x49, WO),
+            ("BSP", "AREA_SPI_DIV", 0x00, 0x4B, WO),
+            ("BSP", "AREA_SPI_DIV", 0x00, 0x4D, WO),
+            ("BSP", "AREA_SPI_DIV", 0x00, 0x4F, WO),
+            ("BSP", "AREA_SPI_DIV", 0x00, 0x51, WO),
+            ("BSP", "AREA_SPI_DIV", 0x00, 0x53, WO),
+            ("BSP", "AREA_SPI_DIV", 0x00, 0x55, WO),
+            ("BSP", "AREA_SPI_DIV", 0x00, 0x57, WO),
+
+            ("BSP", "AREA_SPI_DIV", 0x20, 0x58, WO),  # registeer 0x58 to 0x20
+            ("BSP", "AREA_SPI_DIV", 1, 0x5A, WO),     # update all
+
+            # -------------------------------------------------------
+            ("BSP", "CLK_RST", 1, 0, ACT),         # reset clock
+            (BARRIER, "hold_pulse"),
+            ("BSP", "CLK_RST", 0, 0, ACT),         # power-on again
+            (BARRIER, "wait_clk"),                 # replaces the former fixed 1 s sleep
+            (BARRIER, "check_clk"),
+
+            # ---- Enable CLKs again ----------------------------------
+            ("BSP", "CLK_SEL", 1, 0, CFG),         # 1: 125MHz internal crystal 0:CLK05 extern clock
+            ("BSP", "RESET_N", 0, 0, ACT),
+            (BARRIER, "hold_pulse"),
+            ("BSP", "RESET_N", 1, 0, ACT),
+            (BARRIER, "hold_pulse"),
+
+            # ---- Initialise ADCs -------------------------------------
+            # See address map of ADC (AD9268 chip),
+            # manual AD9268, p. 37
+            ("BSP", "ADC_REVERT_CLK", 0x18, 0, CFG),
+
+            ("BSP", "AREA_SPI_ADC", 0x3C, 0x00, WO),  # 0x3c = bits: 0011 1100
+            ("BSP", "AREA_SPI_ADC", 0x41, 0x14, WO),  # 0x41 = bits: 0100 0001
+            ("BSP", "AREA_SPI_ADC", 0x00, 0x0D, WO),  # 0x00 = bits: 0000 0000
+            ("BSP", "AREA_SPI_ADC", 0x01, 0xFF, WO),  #  setting transfer bit
+
+            ("BSP", "ADC_ENA", 0, 0, ACT),         # power off
+            (BARRIER, "hold_pulse"),
+            ("BSP", "ADC_ENA", 1, 0, ACT),         # power on
+            (BARRIER, "hold_pulse"),
+            ("BSP", "DAC_ENA", 1, 0, CFG),
+
+            # ---- Initialize trigger channels Ch0 & Ch1 -------------------------------
+            ("TIMING", "SOURCE_SEL", 0, 0, CFG),   # DAQ trigger will be sourced from application clock (125MHz)
+            ("TIMING", "SOURCE_SEL", 0, 1, CFG),   # DPM DAC Table strobe will be sourced from application clock (125MHz)
+            ("TIMING", "SOURCE_SEL", 10, 2, CFG),
+
+            ("TIMING", "SYNC_SEL", 1, 1, CFG),     # DPM DAC Table strobe will be synced with DAQ Trigger
+            ("TIMING", "DIVIDER_VALUE", self.app_clk_freq * self.trigger_rate - 1, 0, CFG),
+            ("TIMING", "DIVIDER_VALUE", 0, 1, CFG),
+
+            ("TIMING", "ENABLE", 7, 0, CFG),       # Enable Trigger Channel
+
+            ("APP", "DPM_MODE", 1, 0, CFG),
+            ("APP", "MLVDS_OE", 0x60, 0, CFG),     # Output Enable
+            ("APP", "MLVDS_O", 0x60, 0, CFG),      # Output Value
+
+            # Initialise the strobe signal of the DAQ
+            ("DAQ", "SAMPLES", self.dma_length, 0, CFG),
+            ("DAQ", "STROBE_DIV", self.daq_strobe_div-1, 0, CFG),  # strobe DAQ = clk / xxx # originally set to 99
+            ("DAQ", "TAB_SEL", 0, 0, CFG),         # Choose raw adc signals on mux
+            ("DAQ", "DOUBLE_BUF_ENA", 1, 0, CFG),  # Enable double buffering for Region 0
+            ("DAQ", "ENABLE", 1, 0, CFG),          # Enable DAQ1 for now.
+
+            # ---- Initialise attenuators on the RTM ----------------
+            ("RTM", "ATT_SEL", 255, 0, CFG),
+            ("RTM", "ATT_VAL", 63, 0, CFG),
+            ############ The end ####################################
+        ]
+
+    # Execute a sequence from init_sequence() in order. With diff set, CFG steps
+    # whose register already holds the value are skipped. The CFG registers up to the
+    # next BARRIER are read back together at the start and after each BARRIER, so the
+    # writes in between stay batched; registers written since, or reset with their
+    # module (RESET_REGISTERS), are compared with what was written. Returns the number
+    # of skipped writes.
+    def run_sequence(self, seq, diff=True):
+        n_skipped = 0
+        known = self.read_segment(seq, 0) if diff else {}
+        with self.batch():
+            for n, step in enumerate(seq):
+                if step[0] == BARRIER:
+                    self.flush()
+                    getattr(self, step[1])()
+                    if diff:
+                        known = self.read_segment(seq, n + 1)
+                    continue
+                module, register, value, idx, kind = step
+                values = np.rint(np.atleast_1d(np.asarray(value, dtype=np.float64)))
+                keys = [(module, register, idx + k) for k in range(len(values))]
+                if diff and kind == CFG and all(known.get(key) == v for key, v in zip(keys, values)):
+                    n_skipped += 1
+                    continue
+                self.device_write(module, register, value, idx)
+                reset_module = RESET_REGISTERS.get((module, register))
+                if reset_module is not None:
+                    known = {k: v for k, v in known.items() if k[0] != reset_module}
+                known.update(zip(keys, values))
+        return n_skipped
+
+    # read back the CFG registers of seq from step first up to the next BARRIER, one
+    # read per register over the range of its elements: {(module, register, idx): value}
+    def read_segment(self, seq, first):
+        ranges = {}
+        for step in seq[first:]:
+            if step[0] == BARRIER:
+                break
+            module, register, value, idx, kind = step
+            if kind == CFG:
+                last = idx + len(np.atleast_1d(value)) - 1
+                lo, hi = ranges.get((module, register), (idx, last))
+                ranges[(module, register)] = (min(lo, idx), max(hi, last))
+        known = {}
+        for (module, register), (lo, hi) in ranges.items():
+            readback = np.rint(self.device_read(module, register, hi - lo + 1, lo))
+            known.update(((module, register, lo + k), v) for k, v in enumerate(readback))
+        return known
+
+    # True if all CFG registers of the sequence hold their final value and the clock is fine,
+    # i.e. the sequence was applied before and the board was not power-cycled since
+    # (the SPI state of the AD9510/AD9268 is not checked, see init_board)
+    def sequence_applied(self, seq):
+        final = {}
+        for step in seq:
+            if step[0] != BARRIER and step[4] == CFG:
+                module, register, value, idx, kind = step
+                for k, v in enumerate(np.atleast_1d(value)):
+                    final[(module, register, idx + k)] = v
+        if int(self.device.read("BSP", "CLK_ERR", 1, 0)[0]) != 0:
+            return False
+        for (module, register, idx), value in final.items():
+            if not self.register_matches(module, register, value, idx):
+                return False
+        return True
+
+    def register_matches(self, module, register, value, idx=0):
+        value = np.rint(np.atleast_1d(np.asarray(value, dtype=np.float64)))
+        readback = np.rint(self.device_read(module, register, len(value), idx))
+        return np.array_equal(readback, value)
+
+    # relay function for register writes
+    #
+    # Outside a batch the write is issued immediately. Inside a batch (start_batch)
+    # the writes of one module are queued and sent by flush(), which also runs when
+    # the next write targets another module, so the overall order is preserved.
+    # Instead of a fixed sleep, the engine only waits where the hardware needs it
+    # (see BUSY_REGISTERS); PCIe reads are not reordered before posted writes.
     def device_write(self, module, register, value, idx=0):
         # print(module+'/'+register+'('+str(idx)+')'+'='+str(value))
-        self.device.write(module, register, value, idx)
-        time.sleep(0.01)
+        if self.shadow is not None and self.shadow_redundant(module, register, value, idx):
+            return
+        if not self.batching:
+            self.write_now(module, register, value, idx)
+            return
+        if self.queue_module != module:
+            self.flush()
+            self.queue_module = module
+        self.write_queue.append((register, value, idx))
+
+    def start_batch(self):
+        self.batching = True
+
+    # send the queued writes and write immediately again
+    def end_batch(self):
+        self.flush()
+        self.batching = False
+
+    # with dev.batch(): ... queues the writes of the block, sent at its end (also on errors)
+    @contextlib.contextmanager
+    def batch(self):
+        self.start_batch()
+        try:
+            yield self
+        finally:
+            self.end_batch()
+
+    # send all queued writes; consecutive scalar writes to neighbouring elements
+    # of the same register array are merged into one array write
+    def flush(self):
+        module = self.queue_module
+        merged = []
+        for register, value, idx in self.write_queue:
+            if merged and (module, register) not in BUSY_REGISTERS and np.ndim(value) == 0:
+                last_register, last_values, last_idx = merged[-1]
+                if last_register == register and last_idx + len(last_values) == idx:
+                    last_values.append(value)
+                    continue
+            merged.append((register, [value] if np.ndim(value) == 0 else list(value), idx))
+        self.write_queue = []
+        self.queue_module = None
+        for register, values, idx in merged:
+            self.write_now(module, register, values[0] if len(values) == 1 else values, idx)
+
+    def write_now(self, module, register, value, idx=0):
+        t0 = time.perf_counter()
+        try:
+            self.device.write(module, register, value, idx)
+        except Exception:
+            self.shadow_forget(module, register, value, idx)  # unknown what reached the device
+            raise
+        if self.shadow is not None:
+            self.shadow_update(module, register, value, idx)
+        busy = BUSY_REGISTERS.get((module, register))
+        if busy is not None:
+            self.wait_busy("BSP", busy)
+        dt = time.perf_counter() - t0
+        st = self.write_stats.setdefault((module, register), [0, 0.0, 0.0])
+        st[0] += 1
+        st[1] += dt
+        st[2] = max(st[2], dt)
+
+    # Read relay function: configuration registers written before through device_write
+    # are served from the shadow cache (if enabled), everything else from the hardware.
+    # Queued writes are sent first, so the cache holds what the device holds.
+    def device_read(self, module, register, n=1, idx=0):
+        self.flush()
+        if self.shadow is not None:
+            keys = [(module, register, idx + k) for k in range(n)]
+            if all(key in self.shadow for key in keys):
+                self.shadow_hits += n
+                return np.array([self.shadow[key] for key in keys], dtype=np.float64)
+            self.shadow_misses += n
+        return self.device.read(module, register, n, idx)
+
+    # True if a write is redundant and can be skipped: all elements already hold the value
+    # and no queued write (not yet in the cache) changes the register before
+    def shadow_redundant(self, module, register, value, idx=0):
+        values = np.atleast_1d(np.asarray(value, dtype=np.float64))
+        keys = [(module, register, idx + k) for k in range(len(values))]
+        queued = module == self.queue_module and any(r == register for r, v, i in self.write_queue)
+        redundant = not queued and (module, register) not in ACTION_REGISTERS and \
+            all(self.shadow.get(key) == v for key, v in zip(keys, values))
+        if redundant:
+            self.shadow_hits += len(values)
+        else:
+            self.shadow_misses += len(values)
+        return redundant
+
+    # Record a write in the shadow cache once it has reached the device
+    def shadow_update(self, module, register, value, idx=0):
+        values = np.atleast_1d(np.asarray(value, dtype=np.float64))
+        reset_module = RESET_REGISTERS.get((module, register))
+        if reset_module is not None:
+            self.invalidate(reset_module)
+        for k, v in enumerate(values):
+            self.shadow[(module, register, idx + k)] = v
+
+    # drop the shadow entries of the elements of a write that may have failed
+    def shadow_forget(self, module, register, value, idx=0):
+        if self.shadow is None:
+            return
+        for k in range(len(np.atleast_1d(value))):
+            self.shadow.pop((module, register, idx + k), None)
+
+    # drop shadow entries: all, of one module, or of one register
+    def invalidate(self, module=None, register=None):
+        if self.shadow is None:
+            return
+        if module is None:
+            self.shadow.clear()
+            return
+        for key in [k for k in self.shadow if k[0] == module and (register is None or k[1] == register)]:
+            del self.shadow[key]
+
+    def shadow_stats(self):
+        return {"entries": 0 if self.shadow is None else len(self.shadow),
+                "hits": self.shadow_hits, "misses": self.shadow_misses}
+
+    # poll a status register until it has the expected value, with growing pauses
+    # between the reads (poll_delay .. poll_max_delay)
+    def wait_register(self, module, register, expected, idx=0):
+        t0 = time.perf_counter()
+        delay = self.poll_delay
+        while int(self.device.read(module, register, 1, idx)[0]) != expected:
+            if time.perf_counter() - t0 > self.poll_timeout:
+                print("*** timeout waiting for", module + "." + register, "==", expected)
+                return False
+            time.sleep(delay)
+            delay = min(2 * delay, self.poll_max_delay)
+        return True
+
+    # wait for the end of the transaction started by the last write: the busy flag is
+    # set and cleared again. Right after the write the flag may not be set yet, so a flag
+    # never seen set only counts as done once busy_min_delay has passed.
+    def wait_busy(self, module, register, idx=0):
+        t0 = time.perf_counter()
+        delay = self.poll_delay
+        seen = False
+        while True:
+            busy = int(self.device.read(module, register, 1, idx)[0]) != 0
+            seen = seen or busy
+            dt = time.perf_counter() - t0
+            if not busy and (seen or dt >= self.busy_min_delay):
+                return True
+            if dt > self.poll_timeout:
+                print("*** timeout waiting for", module + "." + register, "to clear")
+                return False
+            time.sleep(delay)
+            delay = min(2 * delay, self.poll_max_delay)
+
+    # wait until the clocking is up again after a CLK_RST: CLK_ERR cleared and the
+    # measured frequency (CLK_FREQ) close to the application clock
+    # minimum width of a reset/power pulse of the init sequence (after the flushed edge)
+    def hold_pulse(self):
+        time.sleep(self.pulse_width)
+
+    def wait_clk(self):
+        self.flush()
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < self.poll_timeout:
+            clk_err = int(self.device.read("BSP", "CLK_ERR", 1, 0)[0])
+            clk_freq = int(self.device.read("BSP", "CLK_FREQ", 1, 1)[0])
+            if clk_err == 0 and abs(clk_freq - self.app_clk_freq) < 0.01 * self.app_clk_freq:
+                return True
+            time.sleep(0.001)
+        print("*** clock not settled after", self.poll_timeout, "s (CLK_ERR:", clk_err, ", CLK_FREQ:", clk_freq, ")")
+        return False
+
+    def reset_write_stats(self):
+        self.write_stats = {}
+
+    # print the per-register write latency (incl. the time spent waiting on busy flags)
+    def print_write_stats(self):
+        print("{:28s} {:>6s} {:>10s} {:>10s} {:>10s}".format("register", "n", "mean[ms]", "max[ms]", "total[ms]"))
+        for (module, register), (n, total, tmax) in sorted(self.write_stats.items(), key=lambda kv: -kv[1][1]):
+            print("{:28s} {:6d} {:10.3f} {:10.3f} {:10.3f}".format(module + "." + register, n, 1e3 * total / n, 1e3 * tmax, 1e3 * total))
 
 
     # Read the currently used DAQ buffer
@@ -181,19 +560,181 @@ class dev4:
         self.device_write("DAQ","DOUBLE_BUF_ENA", 1, 0) # switch dubble buffer on again
         return daq0_data
 
+    # Trigger-synchronous acquisition: block on the DAQ interrupt, then read the buffer
+    # the firmware has just finished while double buffering keeps running.
+    # Returns a frame dict (see read_daq_inactive), or None if no interrupt arrived within timeout [s].
+    def read_daq_irq(self, timeout=None, out=None):
+        channel = self.daq_irq_channel
+        if self.xdma is None:
+            raise RuntimeError("read_daq_irq needs the xDMA device (dev4(dma=True), /dev/xdma/slot{})".format(self.slot))
+        if channel not in self.irq_enabled:
+            self.enable_irq(1, channel)
+            self.irq_enabled.add(channel)
+        if not self.xdma.wait_irq(channel, timeout):
+            return None
+        return self.read_daq_inactive(time.time(), out)
+
+    # Read the buffer which is currently not written by the DAQ (no switching of DOUBLE_BUF_ENA)
+    #   pulse_id:      sequence number of the buffer (DAQ.INACTIVE_BUF_ID)
+    #   trg_cnt:       number of triggers in the buffer (DAQ.TRG_CNT_BUF<n>)
+    #   start_time:    64 bit timestamp of the first sample, trigger_times: trigger offsets;
+    #                  both from DAQ.DAQ_TIMES_0, whose halves belong to buffer 0 and 1
+    #                  (trigger times from word 0, start time high/low in the last two words)
+    #   torn:          the DAQ switched buffers during the read, the data may be partly overwritten
+    # With the xDMA device open, the buffer is read by DMA straight into out (int16,
+    # samples x DAQ_CHANNELS; allocated if None), otherwise through read_sequences.
+    def read_daq_inactive(self, t_host=None, out=None):
+        buf = 1 - int(self.device.read("DAQ", "ACTIVE_BUF", 1, 0)[0])
+        pulse_id = int(self.device.read("DAQ", "INACTIVE_BUF_ID", 1, 0)[0])
+        trg_cnt = int(self.device.read("DAQ", "TRG_CNT_BUF{}".format(buf), 1, 0)[0])
+        base = 512 * buf
+        start = self.device.read("DAQ", "DAQ_TIMES_0", 2, base + 510)
+        trigger_times = self.device.read("DAQ", "DAQ_TIMES_0", min(trg_cnt, 510), base) if trg_cnt > 0 else np.zeros(0)
+        if self.xdma is not None:
+            data = self.xdma.read_daq_buffer(DAQ_BUF_ADDR[buf], self.dma_length, out)
+        else:
+            data = self.device.read_sequences("DAQBUF", "DAQ_CTRL_BUF{}".format(buf))
+            if out is not None:
+                out[...] = data
+                data = out
+        torn = int(self.device.read("DAQ", "INACTIVE_BUF_ID", 1, 0)[0]) != pulse_id
+        return {"time": time.time() if t_host is None else t_host, "buf": buf, "pulse_id": pulse_id,
+                "trg_cnt": trg_cnt, "start_time": (int(start[0]) << 32) | int(start[1]),
+                "trigger_times": trigger_times, "torn": torn, "data": data}
+
+    # Continuous acquisition for long runs (stability tests, recorders, GUI).
+    # Yields frames (see read_daq_inactive) whose 'data' is a slot of a pool (DaqPool) of
+    # pool_size preallocated int16 buffers, 'pool' and 'slot' tell which. With the xDMA
+    # device open, the DMA writes straight into the slot and nothing is allocated per
+    # frame; otherwise the buffer returned by read_sequences is copied into the slot.
+    # Each frame also carries 'missed': triggers since the previous frame whose pulse was
+    # not read (see missed_triggers); totals are kept in frame['pool'].stats.
+    #
+    # By default a slot is handed back when the next frame is requested. With hold=True
+    # the consumer keeps frames until release_frame(frame), e.g. from a display thread;
+    # if all slots are held, acquisition waits (back-pressure, counted in 'waits') and the
+    # triggers lost meanwhile show up in 'missed'. If no slot comes back within timeout [s]
+    # (e.g. release_frame is never called, or by the thread iterating the stream itself),
+    # a RuntimeError is raised instead of waiting forever.
+    # Frames are taken on the DAQ interrupt (use_irq, if the xDMA device is open) or by
+    # polling INACTIVE_BUF_ID.
+    def stream_daq(self, n_frames=None, pool_size=4, hold=False, use_irq=True, timeout=1.0):
+        pool = DaqPool(pool_size, self.dma_length)
+        use_irq = use_irq and self.xdma is not None
+        last = None
+        previous = None
+        while n_frames is None or pool.stats["frames"] < n_frames:
+            if previous is not None and not hold:
+                self.release_frame(previous)
+            previous = None
+            slot = pool.take(timeout)
+            if slot is None:
+                raise RuntimeError("stream_daq: all {} pool slots held for {} s, "
+                                   "release_frame not called?".format(pool_size, timeout))
+
+            if use_irq:
+                frame = self.read_daq_irq(timeout, out=pool.buffers[slot])
+            else:
+                frame = self.poll_daq(None if last is None else last["pulse_id"], timeout, out=pool.buffers[slot])
+            if frame is None:
+                pool.stats["timeouts"] += 1
+                pool.release(slot)
+                continue
+            frame["pool"] = pool
+            frame["slot"] = slot
+
+            frame["missed"] = self.missed_triggers(last, frame)
+            last = frame
+            pool.stats["frames"] += 1
+            pool.stats["missed"] += frame["missed"]
+            pool.stats["torn"] += int(frame["torn"])
+            previous = frame
+            yield frame
+
+    # Triggers between the previous frame of a stream (None: first frame) and this one
+    # whose pulse was not read:
+    #  - buffers the DAQ completed in between (gap in the INACTIVE_BUF_ID sequence number)
+    #  - further triggers into this buffer (TRG_CNT_BUF > 1), which overwrote its pulse
+    #  - triggers that completed no buffer at all: the DAQ_TIMES start times of the two
+    #    frames lie more trigger periods (self.trigger_rate) apart than the above explain
+    def missed_triggers(self, last, frame):
+        missed = max(frame["trg_cnt"] - 1, 0)
+        if last is None or last["pulse_id"] == frame["pulse_id"]:
+            return missed
+        skipped = (frame["pulse_id"] - last["pulse_id"] - 1) % 2**32
+        missed += skipped
+        if last["start_time"] > 0 and frame["start_time"] > last["start_time"]:
+            period = self.app_clk_freq * self.trigger_rate
+            steps = int(round((frame["start_time"] - last["start_time"]) / period))
+            missed += max(steps - 1 - skipped - max(last["trg_cnt"] - 1, 0), 0)
+        return missed
+
+    # hand the pool slot of a frame from stream_daq back (to the stream it came from)
+    def release_frame(self, frame):
+        frame["pool"].release(frame["slot"])
+
+    # wait (by polling) for a buffer with a sequence number other than last_id
+    def poll_daq(self, last_id, timeout=1.0, out=None):
+        t0 = time.perf_counter()
+        while int(self.device.read("DAQ", "INACTIVE_BUF_ID", 1, 0)[0]) == last_id:
+            if time.perf_counter() - t0 > timeout:
+                return None
+            time.sleep(0.001)
+        return self.read_daq_inactive(out=out)
+
+    # wait until the DAQ has completed count more buffers (INACTIVE_BUF_ID); returns False on timeout [s].
+    # After new settings, count=2 gives a buffer captured entirely with them: the buffer
+    # completed at the next trigger still holds the pulse of the trigger before.
+    def wait_daq(self, count=2, timeout=1.0):
+        t0 = time.perf_counter()
+        first_id = int(self.device.read("DAQ", "INACTIVE_BUF_ID", 1, 0)[0])
+        while (int(self.device.read("DAQ", "INACTIVE_BUF_ID", 1, 0)[0]) - first_id) % 2**32 < count:
+            if time.perf_counter() - t0 > timeout:
+                return False
+            time.sleep(0.001)
+        return True
+
     # write in the reference tables
     def update_ref_table(self, ref_i, ref_q):
-        for i in range(1024):
-            self.device.write("APP", "REF_I", ref_i[i], i)
-            self.device.write("APP", "REF_Q", ref_q[i], i)
-        time.sleep(2)
+        self.write_table("APP", "REF_I", ref_i)
+        self.write_table("APP", "REF_Q", ref_q)
 
     # write in the Feedfoward (FFD) tables
     def update_ffd_table(self, ffd_i, ffd_q):
-        for i in range(1024):
-            self.device.write("APP", "FFD_I", ffd_i[i], i)
-            self.device.write("APP", "FFD_Q", ffd_q[i], i)
-        time.sleep(1)
+        self.write_table("APP", "FFD_I", ffd_i)
+        self.write_table("APP", "FFD_Q", ffd_q)
+
+    # write a complete table (APP.REF_I, APP.FFD_Q, ...) in one block transfer
+    # and poll the readback until the table is in place (instead of a blind sleep).
+    # With the shadow cache only the range of changed entries is transferred.
+    def write_table(self, module, register, values, timeout=2.0):
+        data = np.rint(np.asarray(values, dtype=np.float64))
+        start = 0
+        if self.shadow is not None:
+            cached = np.array([self.shadow.get((module, register, i), np.nan) for i in range(len(data))])
+            changed = np.flatnonzero(cached != data)
+            self.shadow_hits += len(data) - len(changed)
+            self.shadow_misses += len(changed)
+            if len(changed) == 0:
+                return True
+            start = changed[0]
+            data = data[start:changed[-1] + 1]
+        self.flush()
+        # the cache only learns the table once the readback has confirmed it
+        self.shadow_forget(module, register, data, start)
+        self.device.write(module, register, data, start)
+        t0 = time.time()
+        while True:
+            readback = self.device.read(module, register, len(data), start)
+            if np.array_equal(readback, data):
+                if self.shadow is not None:
+                    self.shadow_update(module, register, data, start)
+                return True
+            if time.time() - t0 > timeout:
+                print("*** table", module + "." + register, "readback mismatch:",
+                      np.count_nonzero(readback != data), "of", len(data), "entries differ")
+                return False
+            time.sleep(0.001)
 
     def enable_irq(self, enable, channel):
         """Enables the particular PCIe IRQ channel
@@ -1,19 +1,87 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits import mplot3d
-from tqdm import tqdm
-from scipy.fft import fft, fftfreq, ifft
+# matplotlib and scipy are imported on first use, so that importing doFFT stays cheap
 
 
+# phases [deg] wrapped into [lower, lower + 360); the sweeps store phase differences in [0, 360)
+def wrap_phase(p, lower=0.0):
+  return (np.asarray(p) - lower) % 360.0 + lower
+
+
+# freq: known IF [Hz]; if set, getAP evaluates only that frequency (single-bin DFT) instead
+#       of searching the maximum of the full FFT; with refine the frequency is interpolated
+#       from the neighbouring bins, and with track the refined value is used for the next call
+# window: None (rectangular, as before) or a scipy.signal.get_window name, e.g. "hann"
+# workers: threads of scipy.fft for batches (-1: all cores)
+# One instance is a reusable analyser: frequency/time axes, windows and DFT kernels are
+# cached per window length, and the DC-free copy of the input goes to a preallocated
+# workspace, so repeated analyses of equally long windows do not rebuild anything and
+# never modify the input. (Not thread-safe: one instance per thread.)
 class doFFTClass:
-    def __init__(self, ts):
+    def __init__(self, ts, freq=None, refine=False, track=False, window=None, workers=None):
       self.ts = ts
+      self.freq = freq
+      self.refine = refine
+      self.track = track
+      self.window = window
+      self.workers = workers
+      # caches, each cleared when it grows past 64 entries (sizes vary without bound)
+      self.kernels = {}  # (N, freq) -> cos/-sin of 2 pi freq ts n, n = 0..N-1
+      self.axes = {}     # (N, kind) -> frequency or time axis
+      self.windows = {}  # N -> window scaled to sum N (amplitudes as without window)
+      self.work = {}     # shape of the input -> float64 workspace
+
+    def axis(self, N, kind="rfft"):
+      key = (N, kind)
+      if key not in self.axes:
+        if len(self.axes) > 64:
+          self.axes.clear()
+        from scipy.fft import fftfreq, rfftfreq
+        if kind == "rfft":
+          self.axes[key] = rfftfreq(N, self.ts)
+        elif kind == "fft":
+          self.axes[key] = fftfreq(N, self.ts)
+        else:
+          self.axes[key] = np.arange(N) * self.ts
+      return self.axes[key]
+
+    def get_window(self, N):
+      if N not in self.windows:
+        if len(self.windows) > 64:
+          self.windows.clear()
+        from scipy.signal import get_window
+        w = get_window(self.window, N)
+        self.windows[N] = w * (N / np.sum(w))
+      return self.windows[N]
+
+    # s (..., N) as float64 with the mean of each window removed (and the window applied),
+    # in the workspace of that shape
+    def prepare(self, s, remove_dc=True):
+      s = np.asarray(s)
+      if s.shape not in self.work:
+        if len(self.work) > 64:
+          self.work.clear()
+        self.work[s.shape] = np.empty(s.shape)
+      work = self.work[s.shape]
+      np.copyto(work, s)
+      if remove_dc:
+        work -= np.mean(work, axis=-1, keepdims=True)
+      if self.window is not None:
+        work *= self.get_window(s.shape[-1])
+      return work
+
+    # real FFT of the prepared windows (..., N) -> (..., N//2+1) spectrum and its frequency axis
+    def spectrum(self, s):
+      from scipy.fft import rfft
+      work = self.prepare(s)
+      return rfft(work, axis=-1, workers=self.workers, overwrite_x=True), self.axis(work.shape[-1])
 
     def plotFFT(self, s):
+      import matplotlib.pyplot as plt
+      from scipy.fft import fft, ifft
       N = len(s)
-      X  = fft(s)
-      t  = np.arange(N) * self.ts
-      freq = fftfreq(N, self.ts)
+      X  = fft(s, workers=self.workers)
+      t  = self.axis(N, "time")
+      freq = self.axis(N, "fft")
 
       plt.figure(figsize = (12, 6))
       plt.subplot(121)
@@ -34,12 +102,13 @@ class doFFTClass:
       plt.show()
 
 
+    # frequency, amplitude and phase [deg] of the strongest spectral line of s
+    # (DC removed, s itself is not changed)
     def getAP(self, s):
-      s -= np.mean(s) # remove DC component
+      if self.freq is not None:
+        return self.getAP_dft(s)
+      X, freq = self.spectrum(s)
       N = len(s)
-      X  = fft(s)
-      t  = np.arange(N) * self.ts
-      freq = fftfreq(N, self.ts)
 
       im = np.argmax(np.abs(X))
       maxfreq = freq[im]
@@ -48,6 +117,72 @@ class doFFTClass:
       #print("max freq:", maxfreq, "amplitude:", maxAmp, "Phase:",maxPha)
       return maxfreq, maxAmp, maxPha
 
+    # DFT kernel of one frequency for windows of N samples: cos and -sin columns
+    # (real, so real data needs no complex copy)
+    def kernel(self, N, freq):
+      key = (N, freq)
+      if key not in self.kernels:
+        if len(self.kernels) > 64:
+          self.kernels.clear()
+        w = 2 * np.pi * freq * self.ts * np.arange(N)
+        k = np.array([np.cos(w), -np.sin(w)]).T
+        self.kernels[key] = k
+      return self.kernels[key]
+
+    # single-bin DFT of the prepared (DC-free) windows s (..., N) at freq
+    def dft(self, s, freq):
+      X = s @ self.kernel(s.shape[-1], freq)
+      return X[..., 0] + 1j * X[..., 1]
+
+    # Amplitude and phase [deg] at a single frequency (default self.freq), same scaling
+    # as getAP: a single-bin DFT, i.e. the Goertzel result, computed as a product with
+    # a cached kernel. s may also be a batch (..., N) of windows.
+    # With refine, the frequency is interpolated from the DFT at freq and freq +- one
+    # bin (Jacobsen's estimator), and amplitude and phase are taken at the refined frequency.
+    def getAP_dft(self, s, freq=None, refine=None):
+      freq = self.freq if freq is None else freq
+      refine = self.refine if refine is None else refine
+      s = self.prepare(s)
+      N = s.shape[-1]
+      X = self.dft(s, freq)
+      if refine:
+        df = 1.0 / (N * self.ts)
+        Xm = self.dft(s, freq - df)
+        Xp = self.dft(s, freq + df)
+        with np.errstate(invalid="ignore", divide="ignore"):
+          delta = np.real((Xm - Xp) / (2*X - Xm - Xp))
+        delta = np.clip(np.nan_to_num(delta), -0.5, 0.5)
+        freq = freq + delta * df
+        w = 2 * np.pi * np.multiply.outer(freq * self.ts, np.arange(N))
+        X = np.einsum("...n,...n->...", s, np.exp(-1j * w))
+        if self.track:
+          self.freq = float(np.mean(freq))
+      return freq, (2.0/N) * np.abs(X), np.angle(X, deg=True)
+
+    # Analysis of a batch of windows data (pulses x channels x samples) in one call.
+    # Returns a dict of (pulses x channels) arrays freq, amp, pha [deg]: from getAP_dft at
+    # self.freq or, without a known frequency, from the maximum of the real FFT of every
+    # window (same results as getAP). With reference (a channel index) also the differences
+    # to that channel: amp_diff and pha_diff, wrapped into [0, 360) by wrap_phase.
+    def getAP_batch(self, data, reference=None):
+      data = np.asarray(data)
+      if self.freq is not None:
+        freq, amp, pha = self.getAP_dft(data)
+        freq = np.broadcast_to(freq, amp.shape)
+      else:
+        N = data.shape[-1]
+        X, axis = self.spectrum(data)
+        im = np.argmax(np.abs(X), axis=-1)
+        X = np.take_along_axis(X, im[..., None], axis=-1)[..., 0]
+        freq = axis[im]
+        amp = (2.0/N) * np.abs(X)
+        pha = np.angle(X, deg=True)
+      result = {"freq": freq, "amp": amp, "pha": pha}
+      if reference is not None:
+        result["amp_diff"] = amp - amp[..., reference:reference+1]
+        result["pha_diff"] = wrap_phase(pha - pha[..., reference:reference+1])
+      return result
+
 
 
 
@@ -58,3 +193,9 @@ class doFFTClass:
 # doFFT = doFFT(ts)
 # mfreq, AmplitudePulse, PhasePulse = doFFT.getAP(inputsignal)
 # mfreq, AmplitudeMeasured, PhaseMeasured = doFFT.getAP(outputsignal)
+# known IF (5 MHz at 125 MS/s): single-bin DFT instead of the full FFT
+# doFFT = doFFTClass(ts, freq=5e6)
+# mfreq, AmplitudePulse, PhasePulse = doFFT.getAP(inputsignal)
+# all pulses and channels at once, differences to the input channel (index 0 here)
+# r = doFFT.getAP_batch(np.stack([inputsignals, outputsignals], axis=1), reference=0)
+# AmplitudeDiff, PhaseDiff = r["amp_diff"][:, 1], r["pha_diff"][:, 1]
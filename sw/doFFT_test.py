@@ -5,18 +5,12 @@ ts = 8e-9  # sampling constant: a sample every 8ns
 X = np.load('results/sweep_23aug2023/sweep.npz', allow_pickle='True')['a']
 f = doFFT.doFFTClass(ts)
 
-phase_diff = np.zeros(len(X))
-amp_diff  = np.zeros(len(X))
+# output: channel 1 (index 0), input: channel 4 (index 3); all pulses in one call
+r = f.getAP_batch(np.array([[x['data'][3], x['data'][0]] for x in X]), reference=0)
+amp_diff   = r["amp_diff"][:, 1] / r["amp"][:, 0]
+phase_diff = r["pha_diff"][:, 1]
 for i in range(len(X)):
-    o_signal = X[i]['data'][0]
-    i_signal = X[i]['data'][3]
-    i_freq,i_amplitude,i_phase = f.getAP(i_signal)
-    o_freq,o_amplitude,o_phase = f.getAP(o_signal)
-    amp_diff[i]   = (o_amplitude - i_amplitude)/i_amplitude
-    phase_diff[i] = o_phase - i_phase
-    if phase_diff[i]<0:
-        phase_diff[i] += 2*np.pi
-    print(i, "Phase difference", phase_diff)
+    print(i, "Phase difference", phase_diff[i])
 print("STD phase diff:    ", np.std(phase_diff))
 print("STD amplitude diff:", np.std(amp_diff))
 
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+# Running maximum over the previous `window` samples along axis 0, for all
+# columns (channels) at once: out[t] = max(x[max(0, t-window):t]), out[0] = x[0].
+# O(N) block decomposition (van Herk / Gil-Werman): prefix and suffix maxima
+# inside blocks of length window; every window spans at most two blocks.
+def running_max(x, window=100):
+    x = np.asarray(x)
+    n = x.shape[0]
+    w = int(window)
+    fill = np.iinfo(x.dtype).min if np.issubdtype(x.dtype, np.integer) else -np.inf
+    nb = -(-(n + w - 1) // w)  # blocks needed for the padded signal
+    y = np.full((nb * w,) + x.shape[1:], fill, dtype=x.dtype)
+    y[w - 1:w - 1 + n] = x
+    blocks = y.reshape((nb, w) + x.shape[1:])
+    prefix = np.maximum.accumulate(blocks, axis=1).reshape(y.shape)
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(y.shape)
+    # trailing maximum incl. the current sample: window [t-w+1, t] of x
+    trailing = np.maximum(suffix[:n], prefix[w - 1:w - 1 + n])
+    out = np.empty_like(x)
+    out[0] = x[0]
+    out[1:] = trailing[:-1]
+    return out
+
+
+# Magnitude of the analytic signal (Hilbert transform) along axis 0, DC removed
+def hilbert_envelope(x):
+    from scipy.signal import hilbert
+    x = np.asarray(x, dtype=np.float64)
+    return np.abs(hilbert(x - np.mean(x, axis=0), axis=0))
+
+
+# envelope of the columns of x; mode "max" (running maximum) or "hilbert"
+def envelope(x, window=100, mode="max"):
+    if mode == "hilbert":
+        return hilbert_envelope(x)
+    return running_max(x, window)
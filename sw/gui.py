@@ -1,14 +1,13 @@
 
 
 from setPowerSupply import *
-import doFFT
 
-from tqdm import tqdm
 import tkinter as tk
 import numpy as np
 from scipy.fft import fft, fftfreq 
 from scipy.signal import *
 import time
+import os
 
 from tkinter import ttk
 from tkinter.filedialog import askopenfilename, asksaveasfilename
@@ -17,302 +16,83 @@ from tkinter.filedialog import askopenfilename, asksaveasfilename
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure
 from dev4 import dev4
+from measurement import SweepClass, DataClass, RefClass, FfdClass
+from acquisition import AcquisitionThread, RateMeter
+from render import BlitCanvas
+from decimate import Decimator
+from demod import Demodulator
 
 from PIL import ImageTk, Image
 
 
-#
-#
-#
-class SweepClass:
-
-  def __init__(self, start, stop, step, dc, fc, ps):
-    self.start = start
-    self.stop  = stop
-    self.step  = step
-    self.dc    = dc
-    self.fc    = fc
-    self.ps    = ps
-    self.nmax = 100
-    self.filename ="results/sweep.npz"
-  
-  def setSSS(self, start, stop, step):
-    self.start = start
-    self.stop  = stop
-    self.step  = step
-  
-
-  ###########################################################################################
-  def run_sweep(self):
-    ts = 8e-9  # sampling constant: a sample every 8ns
-    f = doFFT.doFFTClass(ts)
-    if self.start<self.stop:
-      _list = []
-      _nmax = int((self.stop - self.start)/self.step)+1
-      print("Sweep from", self.start, "to", self.stop, "in steps of", self.step)
-      
-
-      #### set ranges for voltages
-      ## TODO: fields in GUI
-
-      # set ranges for the sweep
-      _vdds = np.array([32]) 
-      #_vdds = np.linspace(7,32,num=5) 
-      _vgg1s = np.array([2.2]) 
-      #_vgg1s = np.linspace(1.5, 2.2,num=3) 
-      _vgg2s = np.array([1.8]) 
-      #_vgg2s = np.linspace(1.0, 1.8,num=3)
-
-      X = np.zeros((len(_vdds)*len(_vgg1s)*len(_vgg2s)*_nmax, 5+2+2+2) )
-      t = 0
-      # main loops
-      for i1 in tqdm(range(len(_vdds))):
-        for i2 in range(len(_vgg1s)):
-          for i3 in range(len(_vgg2s)):
-            for i in range(_nmax):
-              #self.ps.setVddVgg(_vdds[i1],_vggs[i2])
-              self.ps.setVddVgg1Vgg2(Vdd=_vdds[i1],Vgg1=_vgg1s[i2], Vgg2 = _vgg2s[i3])
-              _level = self.start + self.step*i
-              self.fc.setLevel(_level)
-              self.fc.update()
-              alldata = self.dc.update()
-              # gather data
-              # Ch1,  Ch2/Output,  Ch3/Input,  Ch7.VM, Ch8/reference
-              _data = (alldata[:1200,0], alldata[0:1200,1], alldata[0:1200,2], alldata[0:1200,6], alldata[0:1200, 7])  
-              # csvfilename = "results/csv/s"+str(_level)+ "_Vdd=" + str(np.round(_vdds[i1], decimals=2) + "_Vgg="+str(np.round(_vggs[i2], decimals=2))+".csv"
-              # np.savetxt(csvfilename,_data, delimiter=",")
-              i_freq,i_amplitude,i_phase = f.getAP(alldata[100:800,2]) # read channel 3
-              o_freq,o_amplitude,o_phase = f.getAP(alldata[100:800,1]) # read channel 2
-              _list.append({'Vdd': _vdds[i1], 'Vgg1':_vgg1s[i2], 'Vgg2':_vgg2s[i3], 'Powerlevel':_level, 'i_amp': i_amplitude, 'i_pha': i_phase, 'o_amp': o_amplitude, 'o_pha': o_phase})
-              print("Power level:", _level, "Vdd:", _vdds[i1], "Vgg1:", _vgg1s[i2], 'Vgg2:',_vgg2s[i3], 'diff:',o_amplitude-i_amplitude, o_phase-i_phase)
-              ad = o_amplitude - i_amplitude
-              pd = o_phase - i_phase
-              if pd <0:
-                 pd +=360 
-              X[t, :] = [t, _level, _vdds[i1], _vgg1s[i2], _vgg2s[i3], i_amplitude, i_phase, o_amplitude, o_phase, ad, pd]
-              t += 1
-            try:
-              np.savez_compressed(self.filename,a=_list)
-              np.savetxt('result.csv',X,delimiter=",")
-            except:
-              print("An error occured while saving.")
-      self.ps.off() # switch supply unit off after sweep to avoid overheating
-      print("Sweep finished;")
-      print("---------------")
-     ###########################################################################################
-  
-  def test_sweep(self, nmax):
-    ts = 8e-9  # sampling constant: a sample every 8ns
-    f = doFFT.doFFTClass(ts)
-    # set voltages
-    _level = 20811
-    _vdd = 32.0
-    _vgg1 = 2.2
-    _vgg2 = 1.8
-    self.ps.setVddVgg1Vgg2(Vdd=_vdd,Vgg1=_vgg1, Vgg2 = _vgg2)
-    self.fc.setLevel(_level)
-    self.fc.update()
-
-    time.sleep(1)
-
-    # nmax = 10
-    X = np.zeros((nmax, 1+2+2+2) )
-    _list = []
-    try:
-      for t in tqdm(range(nmax)):
-        alldata = self.dc.update()
-        i_freq,i_amplitude,i_phase = f.getAP(alldata[100:800,2]) # read channel 3
-        o_freq,o_amplitude,o_phase = f.getAP(alldata[100:800,1]) # read channel 2
-        _list.append({'t': t, 'i_amp': i_amplitude, 'i_pha': i_phase, 'o_amp': o_amplitude, 'o_pha': o_phase})
-        ad = o_amplitude - i_amplitude
-        pd = o_phase - i_phase
-        if pd <0: pd +=360 
-        X[t, :] = [t, i_amplitude, i_phase, o_amplitude, o_phase, ad, pd]
-        # print(t, ad, pd)
-    except:
-      print('test aborted')
-    np.savetxt('results/results_fixed_pl'+str(_level)+'.csv',X,delimiter=",")
-    print("Power level:", _level)
-    print("amp diff (mean, STD):",np.mean(X[:,5]), np.std(X[:,5]))
-    print("pha diff (mean, STD):",np.mean(X[:,6]), np.std(X[:,6]))
-    self.ps.off() # switch supply unit off after sweep to avoid overheating
-
-
-
-
-
-
-
-
-
-
-#
-#
-#
-class DataClass:
-  def __init__(self,device):
-    self.device = device
-    self.data = device.read_daq()
-    self.envelope = self.data.copy()
-    for i in range(8):
-      for t in range(1,len(self.data[:,i])):  
-        self.envelope[t,i] = max(self.data[max(0,t-100):t,i])
-    self.offi = 0
-    self.offq =0
-
-
-  def update(self):
-    self.data = self.device.read_daq()
-    self.envelope = self.data.copy()
-    for i in range(8):
-      for t in range(1, len(self.data[:,i])):  
-        self.envelope[t,i] = max(self.data[max(0,t-100):t,i])
-    return self.data
-
-
-
-
-
-
-
-#
-#
-#
-class RefClass:
-  def __init__(self,device):
-    self.device = device
-    self.n = 1024
-    self.t = np.arange(self.n)
-    self.i = np.zeros(self.n)
-    self.q = np.zeros(self.n)
-    self.start= 1
-    self.stop = 800
-    self.level = 500
-    self.switch = 795
-    self.i[self.start: self.switch] = self.level
-    self.i[self.switch: self.stop] = -self.level
-    device.update_ref_table(ref_i=self.i, ref_q=self.q)
-
-  def updateRef(self, start, stop, level, switch):
-    self.i = np.zeros(self.n)
-    self.q = np.zeros(self.n)
-    self.start  = start
-    self.stop   = stop
-    self.level  = level
-    self.switch = switch
-    self.i[self.start: self.switch] = self.level
-    self.i[self.switch: self.stop] =  -self.level
-    self.device.update_ref_table(ref_i=self.i, ref_q=self.q)
-
-  def update(self):
-    self.i = np.zeros(self.n)
-    self.q = np.zeros(self.n)
-    self.i[self.start: self.switch] = self.level
-    self.i[self.switch: self.stop] = -self.level
-    self.device.update_ref_table(ref_i=self.i, ref_q=self.q)
-
-
-  def setStart(self, start):
-    self.start = start
-
-  def setStop(self, stop):
-    self.stop = stop
-
-  def setLevel(self, level):
-    self.level = level
-
-  def setSwitch(self, switch):
-    self.switch = switch
-
-
-
-
-#
-# class with the feedforward signals 
-#  
-class FfdClass:
-  def __init__(self,device):
-    self.device = device
-    self.n = 1024
-    self.t = np.arange(self.n)
-    self.i = np.zeros(self.n)
-    self.q = np.zeros(self.n)
-    self.start  = 1
-    self.stop   = 800
-    self.level  = 1024
-    self.switch = 790
-    self.i[self.start: self.switch] = self.level
-    self.i[self.switch: self.stop]  = - self.level
-    device.update_ffd_table(ffd_i=self.i,  ffd_q=self.q)
-
-
-  def updateFfd(self, start, stop, level, switch):
-    self.i = np.zeros(self.n)
-    self.q = np.zeros(self.n)
-    self.start  = start
-    self.stop   = stop
-    self.level  = level
-    self.switch = switch
-    self.i[self.start: self.switch] = self.level
-    self.i[self.switch: self.stop] = -self.level
-    self.device.update_ffd_table(ffd_i=self.i, ffd_q=self.q)
-
-  def update(self):
-    self.i = np.zeros(self.n)
-    self.q = np.zeros(self.n)
-    self.i[self.start: self.switch] = self.level
-    self.i[self.switch: self.stop] =  -self.level
-    self.device.update_ffd_table(ffd_i=self.i, ffd_q=self.q)
-
-
-  def setStart(self, start):
-    self.start = start
-
-  def setStop(self, stop):
-    self.stop = stop
-
-  def setLevel(self, level):
-    self.level = level
-
-  def setSwitch(self, switch):
-    self.switch = switch
-
-
-
-
 
 ###############################################################################
 ###############################################################################
 
+# "Update!": the acquisition runs in the background thread, poll_frames() shows the result
 def update_window():
-    dc.update();
+    acq.trigger()
+
+# live mode: continuous acquisition at the rate given in the entry field
+def live_window():
+    if acq.live:
+      acq.set_live(False)
+      btn_live.config(text="Live")
+      return
+    try:
+      rate = float(live_rate.get())
+    except ValueError:
+      rate = 1.0
+    acq.set_live(True, rate)
+    btn_live.config(text="Stop live")
+
+# polled from the Tk mainloop: render the newest frame of the acquisition thread, if any
+# (stale frames are dropped by the thread, never queued)
+def poll_frames():
+    frame = acq.latest()
+    if frame is not None:
+      t0 = time.perf_counter()
+      draw_frame(frame)
+      render_meter.tick(time.perf_counter() - t0)
+      acq.render_time = render_meter.duration
+      label_time.config(text="Last Updated: \n" + time.ctime(frame["time"]) +
+        "\n{:.1f} fps (acq. {:.1f} Hz), dropped: {}".format(render_meter.rate, acq.meter.rate, acq.dropped) +
+        "\nacquire {:.0f} ms, process {:.0f} ms, draw {:.0f} ms".format(
+          1e3*frame["t_read"], 1e3*frame["t_process"], 1e3*render_meter.duration))
+    window.after(max(10, min(50, int(250*acq.period))) if acq.live else 50, poll_frames)
+
+# update the line data of all panels, but render only the visible tab;
+# the others are rendered when they are selected (on_tab_changed)
+# (full-length traces are shown min/max decimated to the canvas width)
+def draw_frame(frame):
+    data     = frame["data"]
+    x_raw, raw = decimator.get(frame, "raw")
+    x_env, env = decimator.get(frame, "envelope")
     for i in range(8): 
-      ax1[i].clear()
-      ax1[i].plot(dc.data[:,i])
-      ax1[i].grid()
-      ax1[i].set_ylabel("Raw")
-
-      ax2[i].clear()
-      #ax2[i].plot(10*np.log10(1+dc.envelope[:,i]),'k-')
-      ax2[i].plot(dc.envelope[:,i],'k-')
-      ax2[i].grid()
-      ax2[i].set_ylabel("Envelope")
-
+      blit[i].set_line(0, raw[:,i], x_raw)
       if i==7 or i==6: 
-        ax2[i].clear()
-        ax2[i].plot(dc.data[:100,i],'xk-')
-        ax2[i].grid()
-        ax2[i].set_ylabel("Zoom")
-
-      canvas[i].draw_idle()
+        blit[i].set_line(1, data[:100,i])
+      else:
+        #blit[i].set_line(1, 10*np.log10(1+env[:,i]))
+        blit[i].set_line(1, env[:,i], x_env)
     for i in range(8):
-      axc[i].clear()
-      axc[i].plot(dc.data[:1250,8+i])
-      axc[i].set_title(titles[i])
-      axc[i].grid()
-      if i<6: axc[i].set_xticklabels([])
-    canvasc.draw_idle()
-    label2c.config(text="Canvas panel (Updated:"+time.ctime(time.time())+")")
+      blitc.set_line(i, frame["controller"][:,i])
+    label2c.config(text="Canvas panel (Updated:"+time.ctime(frame["time"])+")")
+    if "demod" in frame:
+      iq = frame["demod"]
+      for i in range(8):
+        blitd.set_line(2*i,   iq["amp"][:,i], 1e6*iq["t"])
+        blitd.set_line(2*i+1, iq["pha"][:,i], 1e6*iq["t"])
+      label2d.config(text="Canvas panel (Updated:"+time.ctime(frame["time"])+")")
+    refresh_visible()
+
+def refresh_visible():
+    b = tab_blit.get(tabControl.select())
+    if b is not None and (b.stale or b.dirty):
+      b.refresh()
+
+def on_tab_changed(event):
+    refresh_visible()
 
 
 
@@ -326,9 +106,6 @@ def update_window():
 
 
 
-#async def update1hz_window():
-#    update_window()
-#    await asyncio.sleep(1)
 
 def sweep_window():
     #askopenfilename(title='Open script')
@@ -406,11 +183,13 @@ def sweep_window():
 
 def runsweep():
     sw.setSSS(int(sw_start.get()), int(sw_stop.get()), int(sw_step.get()) )
-    sw.run_sweep()
+    with dc.lock:  # the sweep owns the board until it is finished
+      sw.run_sweep()
     sw_update_time_lbl.config(text="Last Updated:\n" + time.ctime(time.time()) )
 
 def test_sweep():
-    sw.test_sweep(int(sw_nmax.get()))
+    with dc.lock:
+      sw.test_sweep(int(sw_nmax.get()))
     sw_update_time_lbl.config(text="Last Updated:\n" + time.ctime(time.time()) )
 
 
@@ -565,18 +344,21 @@ def pulse_window():
     lbtn_update.grid(row=3, column=0, sticky="ew", padx=5)
 
 
+# Callbacks which access the board hold dc.lock, like the acquisition thread does
+# for every frame, so the two threads never use the device at the same time.
 def getSSLS():
     rc.setStart(int(lentry_start.get()))
     rc.setStop(int(lentry_stop.get()))
     rc.setLevel(int(lentry_level.get()))
     rc.setSwitch(int(lentry_switch.get()))
-    rc.update()
 
     fc.setStart(int(fentry_start.get()))
     fc.setStop(int(fentry_stop.get()))
     fc.setLevel(int(fentry_level.get()))
     fc.setSwitch(int(fentry_switch.get()))
-    fc.update()
+    with dc.lock:
+      rc.update()
+      fc.update()
 
     lax.clear()
     lax.plot(rc.t, rc.i, 'b-', label="I ref" )
@@ -602,16 +384,22 @@ def getSSLS():
 #
 #########################################################################################
 print('... initialisation ...')
-d = dev4()
+# DEV4_BACKEND=sim runs the GUI on the simulated board and power supply (include/sim.py)
+backend = os.environ.get("DEV4_BACKEND", "mtca4u")
+d = dev4(backend=backend)
 d.init_board()
 
 dc = DataClass(d)
-ps = setPowerSupplyClass()
+if backend == "sim":
+  from include.sim import sim_supply
+  ps = setPowerSupplyClass(client=sim_supply(d.xdma))
+else:
+  ps = setPowerSupplyClass()
 ps.setVddVgg1Vgg2(Vdd=0.0, Vgg1=0.0, Vgg2=0.0)
 
 rc = RefClass(d)
 fc = FfdClass(d)
-sw = SweepClass(1000,30_000,10000, dc, fc, ps)
+sw = SweepClass(1000,30_000,10000, dc, fc, ps, rc)
 
 window = tk.Tk()
 window.title("dev4")
@@ -653,9 +441,11 @@ tab7 = ttk.Frame(tabControl)
 tab8 = ttk.Frame(tabControl)
 tab0 = ttk.Frame(tabControl)
 tabc = ttk.Frame(tabControl)
+tabd = ttk.Frame(tabControl)
 
 tabControl.add(tab0, text ='  Overview  ')
 tabControl.add(tabc, text ='  Controller  ')
+tabControl.add(tabd, text ='  I/Q demod.  ')
 tabControl.add(tab1, text ='  Ch.1  ')
 tabControl.add(tab2, text ='  Ch.2  ')
 tabControl.add(tab3, text ='  Ch.3  ')
@@ -665,6 +455,7 @@ tabControl.add(tab6, text ='  Ch.6  ')
 tabControl.add(tab7, text ='  Ch.7=VM  ')
 tabControl.add(tab8, text ='  Ch.8=REF  ')
 tabControl.pack(expand = 1, fill ="both")
+tabControl.bind("<<NotebookTabChanged>>", on_tab_changed)
 tabs=[tab1,tab2,tab3,tab4,tab5,tab6,tab7,tab8]
 
 # overview tab tab0
@@ -679,6 +470,8 @@ ax1 = [None]*8
 ax2 = [None]*8
 canvas = [None]*9
 toolbar = [ None]*8
+blit = [None]*8
+tab_blit = {}  # notebook tab -> BlitCanvas shown in it
 
 for i in range(8):
     frm_tab_cfg = tk.Frame(master=tabs[i], relief=tk.RAISED, bd=2, highlightbackground="white", highlightthickness=2)
@@ -704,24 +497,24 @@ for i in range(8):
     fig[i] = Figure(figsize=(9,8), dpi=100)
     ax1[i] = fig[i].add_subplot(211)
 
-    ax1[i].plot(dc.data[:,i])
+    line1, = ax1[i].plot(dc.data[:,i])
     ax1[i].grid()
     ax1[i].set_ylabel("Raw")
 
     ax2[i] = fig[i].add_subplot(212)
-    #ax2[i].plot(10*np.log10(1+dc.envelope[:,i]),'k-')
-    ax2[i].plot(dc.envelope[:,i],'k-')
-    ax2[i].set_ylabel("Envelope")
-    ax2[i].grid()
-
     if i==7 or i==6:
-      ax2[i].clear()
-      ax2[i].plot(dc.data[:100,i],'kx-')
-      ax2[i].grid()
+      line2, = ax2[i].plot(dc.data[:100,i],'kx-')
       ax2[i].set_ylabel("Zoom")
+    else:
+      #line2, = ax2[i].plot(10*np.log10(1+dc.envelope[:,i]),'k-')
+      line2, = ax2[i].plot(dc.envelope[:,i],'k-')
+      ax2[i].set_ylabel("Envelope")
+    ax2[i].grid()
 
     # make plots
     canvas[i] = FigureCanvasTkAgg(fig[i], master=frm_tab_fig)
+    blit[i] = BlitCanvas(canvas[i], [line1, line2])
+    tab_blit[str(tabs[i])] = blit[i]
     canvas[i].draw()
     canvas[i].get_tk_widget().grid(column=0, row=1)
 
@@ -753,15 +546,18 @@ for j in range(len(names)):
 titles=["reference I(r)","measured y", "I(y)", "Q(y)", "error (I(r) - I(y))", "error (Q(r) - Q(y))", "I(u)","Q(u)"]
 figc = Figure(figsize=(9,8), dpi=100)
 axc = [None]*8
+linec = [None]*8
 for i in range(8):
   axc[i] = figc.add_subplot(4,2,i+1)
-  axc[i].plot(dc.data[:100,8+i],'-x')
+  linec[i], = axc[i].plot(dc.data[:1250,8+i])
   axc[i].set_title(titles[i])
   axc[i].grid()
   if i<6: axc[i].set_xticklabels([])
   #axc.set_ylabel("(Weighted) Input signal")
 # plot controller tab on GUI
 canvasc = FigureCanvasTkAgg(figc, master=frm_tabc_fig)
+blitc = BlitCanvas(canvasc, linec)
+tab_blit[str(tabc)] = blitc
 canvasc.draw()
 canvasc.get_tk_widget().grid(column=0, row=1)
 
@@ -771,6 +567,39 @@ toolbarc.update()
 toolbarc.grid(row=2, column=0)
 
 
+##################################################
+## software I/Q demodulation of the ADC channels ##
+##################################################
+# amplitude (black) and phase (blue, right axis) along the frame, decimated to IF periods
+demod = Demodulator(ts=8e-9, if_freq=5e6)
+frm_tabd_fig = tk.Frame(master=tabd, relief=tk.RAISED, bd=2)
+frm_tabd_fig.grid(column=0, row=0)
+label2d = tk.Label(master=frm_tabd_fig, text="Canvas panel (Updated:"+time.ctime(time.time())+")", fg="#555")
+label2d.grid(column=0, row=0)
+iq0 = demod.process(dc.data[:,:8])
+figd = Figure(figsize=(9,8), dpi=100)
+lined = [None]*16
+for i in range(8):
+  axd = figd.add_subplot(4,2,i+1)
+  axp = axd.twinx()
+  lined[2*i],   = axd.plot(1e6*iq0["t"], iq0["amp"][:,i], 'k-')
+  lined[2*i+1], = axp.plot(1e6*iq0["t"], iq0["pha"][:,i], 'b-', lw=0.5)
+  axd.set_title("Ch.{} amplitude / phase [deg]".format(i+1))
+  axd.grid()
+  if i<6: axd.set_xticklabels([])
+  else: axd.set_xlabel("t [us]")
+figd.tight_layout()
+canvasd = FigureCanvasTkAgg(figd, master=frm_tabd_fig)
+blitd = BlitCanvas(canvasd, lined)
+tab_blit[str(tabd)] = blitd
+canvasd.draw()
+canvasd.get_tk_widget().grid(column=0, row=1)
+
+toolbard = NavigationToolbar2Tk(canvasd, frm_tabd_fig, pack_toolbar=False)
+toolbard.update()
+toolbard.grid(row=2, column=0)
+
+
 # buttons
 btn_info = tk.Button(master=frm_cfg, text="Info ...",     command=info_window)
 btn_info.grid(row=1, column=0, sticky="ew", padx=5)
@@ -781,8 +610,11 @@ btn_update.grid(row=20, column=0, sticky="ew", padx=5)
 btn_saveall = tk.Button(master=frm_cfg, text="Save Signals now ...",     command=lambda:saveas_all())
 btn_saveall.grid(row=3, column=0, sticky="ew", padx=5)
 
-#btn_reboot = tk.Button(master=frm_cfg, text="Update 1Hz",     command=update_window )
-#btn_reboot.grid(row=2, column=0, sticky="ew", padx=5)
+btn_live = tk.Button(master=frm_cfg, text="Live",     command=live_window)
+btn_live.grid(row=21, column=0, sticky="ew", padx=5)
+live_rate = tk.Entry(frm_cfg, width="10")
+live_rate.insert(0, "1.0")  # target rate [Hz]
+live_rate.grid(row=22, column=0, sticky="ew", padx=5)
 
 btn_script = tk.Button(master=frm_cfg, text="Sweep ...",     command=sweep_window)
 btn_script.grid(row=4, column=0, sticky="ew", padx=5)
@@ -811,8 +643,16 @@ label0.grid(column=0, row=0, sticky="ew", padx=5)
 frm_cfg.grid(row=0, column=0, sticky="ns")
 frm_main.grid(row=0, column=1, sticky="nsew")
 
+# background acquisition, consumed by poll_frames()
+acq = AcquisitionThread(dc, demod=demod)
+acq.start()
+render_meter = RateMeter()
+decimator = Decimator(n_px=900)  # canvas width in pixels (figsize 9 in at 100 dpi)
+window.after(50, poll_frames)
+
 window.config(menu=menu)
 window.mainloop()
+acq.stop()
 
 
 
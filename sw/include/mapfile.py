@@ -0,0 +1,103 @@
+#! /usr/bin/env python3
+
+"""
+Named register access without ChimeraTK/mtca4u.
+register_map parses a ChimeraTK mapfile (e.g. ch13.mapp) into an array-backed
+table with a dict for the name lookup; mapped_device offers the read/write/
+read_sequences calls of mtca4u.Device on top of xdma_wrapper, with the
+fixed-point and sign conversion given by the map columns.
+"""
+
+import numpy as np
+
+from include.xdma_wrapper import AXI_LITE_MEM_SIZE, DAQ_CHANNELS
+
+# columns of a mapfile line after the name
+MAP_DTYPE = np.dtype([
+    ("n_elements", np.int64),
+    ("address", np.int64),
+    ("n_bytes", np.int64),
+    ("bar", np.int64),
+    ("width", np.int64),
+    ("frac_bits", np.int64),
+    ("signed", np.int64),
+    ("access", "U2"),
+])
+
+class register_map():
+    def __init__(self, filename):
+        self.names = []
+        rows = []
+        with open(filename) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 9 or fields[0].startswith("#") or fields[0].startswith("@"):
+                    continue
+                self.names.append(fields[0])
+                rows.append((int(fields[1]), int(fields[2], 0), int(fields[3]), int(fields[4]),
+                             int(fields[5]), int(fields[6]), int(fields[7]), fields[8]))
+        self.table = np.array(rows, dtype=MAP_DTYPE)
+        self.rows = self.table.tolist()  # python tuples for the per-call lookups
+        # "MODULE.REGISTER" -> row; later entries do not overwrite earlier ones
+        self.index = {}
+        for row, name in enumerate(self.names):
+            module, _, register = name.partition(".")
+            self.index.setdefault((module, register), row)
+
+    def lookup(self, module, register):
+        try:
+            return self.index[(module, register)]
+        except KeyError:
+            raise KeyError("register {}.{} not in the mapfile".format(module, register))
+
+    def to_physical(self, row, raw):
+        # raw register words -> values, per width, signedness and fractional bits of the row
+        n, address, n_bytes, bar, width, frac_bits, signed, access = self.rows[row]
+        values = np.asarray(raw).astype(np.int64) & ((1 << width) - 1)
+        if signed:
+            values -= (values >> (width - 1)) << width
+        return values * 2.0**-frac_bits
+
+    def to_raw(self, row, values):
+        # values -> register words (two's complement in the register width)
+        n, address, n_bytes, bar, width, frac_bits, signed, access = self.rows[row]
+        raw = np.rint(np.asarray(values, dtype=np.float64) * 2.0**frac_bits).astype(np.int64)
+        return raw & ((1 << width) - 1)
+
+
+class mapped_device():
+    # same calls as mtca4u.Device, on a register_map and an opened xdma_wrapper
+    def __init__(self, regmap, xw):
+        self.map = regmap
+        self.xw = xw
+
+    def read(self, module, register, n=0, idx=0):
+        row = self.map.lookup(module, register)
+        n_elements, address, n_bytes, bar, width, frac_bits, signed, access = self.map.rows[row]
+        if n == 0:
+            n = n_elements - idx
+        if idx + n > n_elements:
+            raise IndexError("{}.{} has {} elements".format(module, register, n_elements))
+        return self.map.to_physical(row, self.xw.read_block(self.register_address(row, idx), n))
+
+    def write(self, module, register, data, idx=0):
+        row = self.map.lookup(module, register)
+        n_elements, address, n_bytes, bar, width, frac_bits, signed, access = self.map.rows[row]
+        raw = self.map.to_raw(row, np.atleast_1d(data))
+        if idx + len(raw) > n_elements:
+            raise IndexError("{}.{} has {} elements".format(module, register, n_elements))
+        if access == "RO":
+            raise PermissionError("{}.{} is read-only".format(module, register))
+        self.xw.write_block(self.register_address(row, idx), raw)
+
+    def read_sequences(self, module, region):
+        # multiplexed DAQ region (e.g. "DAQBUF", "DAQ_CTRL_BUF0") as (samples x channels) array
+        row = self.map.lookup(module, "MEM_MULTIPLEXED_" + region)
+        n_elements, address, n_bytes, bar, width, frac_bits, signed, access = self.map.rows[row]
+        return self.xw.read_daq_buffer(address, n_bytes // (2 * DAQ_CHANNELS))
+
+    def register_address(self, row, idx):
+        n_elements, address, n_bytes, bar, width, frac_bits, signed, access = self.map.rows[row]
+        if n_bytes != 4 * n_elements or address + n_bytes > AXI_LITE_MEM_SIZE:
+            raise ValueError("{} is not a 32 bit register in the AXI-Lite area".format(self.map.names[row]))
+        return address + 4 * idx
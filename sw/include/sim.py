@@ -0,0 +1,226 @@
+#! /usr/bin/env python3
+
+"""
+Simulated board for running dev4 without the sis8300ku (benchmarks, tests, laptop).
+sim_xdma stands in for xdma_wrapper below mapped_device: an in-memory register
+file at the addresses of the mapfile plus the double buffered DAQ memory, where
+every trigger captures synthetic IF pulses shaped by the current FFD/REF tables,
+with noise, into the active buffer. sim_supply is a socket-like fake of the
+SCPI power supply for setPowerSupplyClass; its Vdd feeds back into the
+simulated amplifier.
+"""
+
+import re
+import time
+import numpy as np
+
+from include.xdma_wrapper import AXI_LITE_MEM_SIZE, DAQ_CHANNELS
+
+APP_CLK_FREQ = 125_000_000
+DAQ_BUF_ADDR = [0x80000000, 0x80100000]
+
+class sim_xdma():
+    def __init__(self, regmap, samples=16384, if_freq=5e6, noise=2.0, seed=0):
+        self.map = regmap
+        self.samples = samples
+        self.if_freq = if_freq    # [Hz] IF of the simulated RF signals
+        self.noise = noise        # [LSB] rms noise of all channels
+        self.rng = np.random.default_rng(seed)
+        self.mem = np.zeros(AXI_LITE_MEM_SIZE // 4, dtype=np.uint32)
+        self.daq = np.zeros((2, samples, DAQ_CHANNELS), dtype=np.int16)
+        self.supply = {1: 32.0, 2: 2.2, 3: 1.8}   # voltages of the supply outputs (see sim_supply)
+
+        # amplifier model: saturation at sat*Vdd/32 [LSB], AM/PM up to am_pm [deg] at saturation
+        self.gain = 4.0
+        self.sat = 12000.0
+        self.am_pm = 20.0
+
+        for name, value in (("BSP.PRJ_TIMESTAMP", int(time.time())), ("BSP.CLK_ERR", 0)):
+            self.set(name, value)
+        self.set("BSP.CLK_FREQ", [APP_CLK_FREQ] * 8)
+        self.t_trigger = time.perf_counter()   # time of the last trigger handled
+
+    def address(self, name):
+        module, _, register = name.partition(".")
+        return self.map.rows[self.map.lookup(module, register)][1]
+
+    def set(self, name, values):
+        a = self.address(name) // 4
+        values = np.atleast_1d(values)
+        self.mem[a : a + len(values)] = np.asarray(values, dtype=np.int64) & 0xFFFFFFFF
+
+    def get(self, name, n=1, idx=0, signed=False):
+        a = self.address(name) // 4 + idx
+        words = self.mem[a : a + n]
+        return words.view(np.int32) if signed else words
+
+    # ---- xdma_wrapper interface -------------------------------------------------
+    def read(self, addr):
+        self.advance()
+        return np.array([self.mem[addr // 4]])
+
+    def write(self, addr, data):
+        self.advance()   # triggers before the write still see the old settings
+        self.mem[addr // 4] = int(data) & 0xFFFFFFFF
+
+    def read_block(self, addr, n_words):
+        self.advance()
+        return self.mem[addr // 4 : addr // 4 + n_words].copy()
+
+    def write_block(self, addr, data):
+        self.advance()
+        words = np.asarray(data, dtype=np.int64).ravel() & 0xFFFFFFFF
+        self.mem[addr // 4 : addr // 4 + len(words)] = words
+
+    def gather(self, addr, n, stride=4):
+        self.advance()
+        return self.mem[addr // 4 : addr // 4 + n * stride // 4 : stride // 4].copy()
+
+    def gather_regions(self, regions):
+        return [self.read_block(addr, n) for addr, n in regions]
+
+    def read_dma(self, addr, len_bytes):
+        self.advance()
+        return np.frombuffer(self.daq[DAQ_BUF_ADDR.index(addr)].tobytes()[:len_bytes], np.uint8)
+
+    def read_dma_into(self, addr, buf):
+        self.advance()
+        dst = np.frombuffer(memoryview(buf).cast("B"), np.uint8)
+        src = self.daq[DAQ_BUF_ADDR.index(addr)].reshape(-1).view(np.uint8)
+        dst[:] = src[:len(dst)]
+        return len(dst)
+
+    def read_daq_buffer(self, addr, samples, out=None):
+        self.advance()
+        data = self.daq[DAQ_BUF_ADDR.index(addr), :samples]
+        if out is None:
+            return data.copy()
+        out[...] = data
+        return out
+
+    def wait_irq(self, irq_channel, timeout=None):
+        # 'buffer done' at the next trigger
+        t_next = self.t_trigger + self.period()
+        dt = t_next - time.perf_counter()
+        if timeout is not None and dt > timeout:
+            time.sleep(timeout)
+            return False
+        if dt > 0:
+            time.sleep(dt)
+        self.advance()
+        return True
+
+    # ---- simulated firmware -----------------------------------------------------
+    def period(self):
+        # trigger period [s] from the DAQ trigger divider (TIMING.DIVIDER_VALUE[0])
+        divider = int(self.get("TIMING.DIVIDER_VALUE")[0])
+        return (divider + 1) / APP_CLK_FREQ if divider > 0 else 0.1
+
+    # handle the triggers since the last call: with double buffering, every trigger completes
+    # the active buffer and the DAQ switches to the other one
+    def advance(self):
+        period = self.period()
+        n_new = int((time.perf_counter() - self.t_trigger) / period)
+        if n_new <= 0:
+            return
+        self.t_trigger += n_new * period
+        active = int(self.get("DAQ.ACTIVE_BUF")[0])
+        if not self.get("DAQ.DOUBLE_BUF_ENA")[0]:
+            self.daq[active] = self.pulse()
+            return
+        # the buffer completed by the last trigger holds the pulse of the trigger before
+        # (captured with the settings of then); the new active buffer captures the pulse
+        # of the current settings, as writes always call advance() first
+        done = active if n_new % 2 else 1 - active
+        if n_new > 1:
+            self.daq[done] = self.pulse()
+        self.daq[1 - done] = self.pulse()
+        ticks = int(self.t_trigger * APP_CLK_FREQ)
+        base = 512 * done
+        times = self.get("DAQ.DAQ_TIMES_0", 1024)
+        times[base] = 0
+        times[base + 510] = (ticks >> 32) & 0xFFFFFFFF
+        times[base + 511] = ticks & 0xFFFFFFFF
+        self.set("DAQ.TRG_CNT_BUF{}".format(done), 1)
+        self.set("DAQ.ACTIVE_BUF", 1 - done)
+        self.set("DAQ.INACTIVE_BUF_ID", int(self.get("DAQ.INACTIVE_BUF_ID")[0]) + n_new)
+
+    # one DAQ buffer: (samples x 16) int16
+    #   0: forward (drive), 1: amplifier output, 2: amplifier input, 3-5: noise only,
+    #   6: vector modulator output (drive), 7: reference (REF table) on the IF;
+    #   8-11: REF_I, REF_Q, FFD_I, FFD_Q tables as baseband, 12-15: noise only
+    def pulse(self):
+        n = self.samples
+        n_tab = 1024
+        ref = self.get("APP.REF_I", n_tab, signed=True) + 1j * self.get("APP.REF_Q", n_tab, signed=True)
+        ffd = self.get("APP.FFD_I", n_tab, signed=True) + 1j * self.get("APP.FFD_Q", n_tab, signed=True)
+        drive = np.zeros(n, dtype=complex)
+        drive[:n_tab] = ffd
+        reference = np.zeros(n, dtype=complex)
+        reference[:n_tab] = ref
+
+        # amplifier: saturating AM/AM, AM/PM, switched off without drain voltage
+        sat = self.sat * max(self.supply[1], 0.0) / 32.0
+        a = np.abs(self.gain * drive)
+        if sat > 0:
+            out_amp = sat * np.tanh(a / sat)
+            out_pha = np.deg2rad(self.am_pm) * (out_amp / sat) ** 2
+        else:
+            out_amp = np.zeros(n)
+            out_pha = np.zeros(n)
+        output = out_amp * np.exp(1j * (np.angle(drive) + out_pha))
+
+        lo = np.exp(2j * np.pi * self.if_freq / APP_CLK_FREQ * np.arange(n))
+        data = self.noise * self.rng.standard_normal((n, DAQ_CHANNELS), dtype=np.float32)
+        data[:, 0] += (drive * lo).real
+        data[:, 1] += (output * lo).real
+        data[:, 2] += (drive * lo).real
+        data[:, 6] += (drive * lo).real
+        data[:, 7] += (reference * lo).real
+        data[:, 8] += reference.real
+        data[:, 9] += reference.imag
+        data[:, 10] += drive.real
+        data[:, 11] += drive.imag
+        return np.clip(np.rint(data), -32768, 32767).astype(np.int16)
+
+
+# socket-like fake of the SCPI power supply (INST OUTn, VOLT x, VOLT?, OUTP SEL, OUTP:GEN:STAT);
+# use as setPowerSupplyClass(client=sim_supply(device.xdma)) to drive the simulated amplifier
+class sim_supply():
+    COMMAND = re.compile(r"INST OUT(\d)|VOLT\?|VOLT ([-+\d.eE]+)|OUTP SEL (ON|OFF)|OUTP:GEN:STAT (ON|OFF)")
+
+    def __init__(self, sim=None):
+        self.sim = sim
+        self.volt = {1: 0.0, 2: 0.0, 3: 0.0}
+        self.enabled = {1: False, 2: False, 3: False}
+        self.general = False
+        self.channel = 1
+        self.answers = []
+        self.update()
+
+    def send(self, data):
+        # commands may arrive without newline, e.g. 'OUTP:GEN:STAT ON' followed by 'INST OUT1'
+        for m in self.COMMAND.finditer(data.decode("ascii")):
+            channel, volt, sel, general = m.groups()
+            if channel is not None:
+                self.channel = int(channel)
+            elif volt is not None:
+                self.volt[self.channel] = float(volt)
+            elif sel is not None:
+                self.enabled[self.channel] = sel == "ON"
+            elif general is not None:
+                self.general = general == "ON"
+            else:
+                self.answers.append("{:.3f}\n".format(self.volt[self.channel]))
+        self.update()
+        return len(data)
+
+    def recv(self, size):
+        return self.answers.pop(0).encode("ascii") if self.answers else b""
+
+    def update(self):
+        # voltages at the outputs
+        if self.sim is not None:
+            for channel in self.volt:
+                on = self.general and self.enabled[channel]
+                self.sim.supply[channel] = self.volt[channel] if on else 0.0
@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+
+"""
+asyncio based dispatcher for the xDMA event channels (/dev/xdma/slotN/eventsX).
+All channels are watched by the event loop (epoll on Linux) in one thread, so
+DAQ-done, timing and interlock interrupts can be serviced concurrently without
+a thread per channel.
+Any readable file descriptors can be used as source, e.g. pipes or eventfds
+as a fake for tests without hardware.
+"""
+
+import asyncio
+import os
+import time
+import numpy as np
+
+from include.xdma_wrapper import NUMBER_OF_IRQ_CHANNELS
+
+SERVICE_BINS_US = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000] # upper bin edges, last bin: above
+
+class irq_dispatcher():
+    def __init__(self, fds, read_size=4):
+        # read_size: bytes per read, 4 for the xDMA event files, 8 for an eventfd
+        self.fds = list(fds)
+        self.read_size = read_size
+        self.callbacks = [[] for fd in self.fds]
+        self.waiters = [[] for fd in self.fds]
+        self.counts = np.zeros(len(self.fds), dtype=np.int64)
+        self.errors = np.zeros(len(self.fds), dtype=np.int64)   # callbacks that raised
+        # service time of an interrupt: from the loop noticing the event to the end of its
+        # callbacks (not the interrupt latency, which would need a firmware timestamp)
+        self.service_hist = np.zeros((len(self.fds), len(SERVICE_BINS_US) + 1), dtype=np.int64)
+        self.last_time = [None] * len(self.fds)
+        self.loop = None
+
+    @classmethod
+    def from_wrapper(cls, xw):
+        # all event channels of an opened xdma_wrapper
+        return cls(xw.fd_irq[:NUMBER_OF_IRQ_CHANNELS])
+
+    def on_irq(self, channel, callback):
+        # callback(channel, t) is called in the event loop for every interrupt, t: time.time() of the event;
+        # an exception is printed and counted in errors, the other callbacks still run
+        self.callbacks[channel].append(callback)
+
+    async def wait(self, channel):
+        # await the next interrupt on channel, returns its time.time()
+        if self.loop is None:
+            raise RuntimeError("irq_dispatcher.wait: call start() first, no event loop watches the channels")
+        future = self.loop.create_future()
+        self.waiters[channel].append(future)
+        return await future
+
+    def start(self, loop=None):
+        self.loop = loop if loop is not None else asyncio.get_running_loop()
+        for channel, fd in enumerate(self.fds):
+            self.loop.add_reader(fd, self.handle, channel)
+
+    def stop(self):
+        for fd in self.fds:
+            self.loop.remove_reader(fd)
+
+    def handle(self, channel):
+        t0 = time.perf_counter()
+        t_event = time.time()
+        raw = os.read(self.fds[channel], self.read_size)
+        self.counts[channel] += max(int.from_bytes(raw, "little"), 1) if raw else 1
+        self.last_time[channel] = t_event
+        # waiters first: a failing callback must not leave them hanging
+        waiters, self.waiters[channel] = self.waiters[channel], []
+        for future in waiters:
+            if not future.done():
+                future.set_result(t_event)
+        for callback in self.callbacks[channel]:
+            try:
+                callback(channel, t_event)
+            except Exception as e:
+                self.errors[channel] += 1
+                print("*** irq channel {}: callback {!r} failed: {!r}".format(channel, callback, e))
+        # service time: read of the event plus all callbacks
+        service_us = 1e6 * (time.perf_counter() - t0)
+        self.service_hist[channel, np.searchsorted(SERVICE_BINS_US, service_us)] += 1
+
+    def print_stats(self):
+        edges = ["<={}".format(b) for b in SERVICE_BINS_US] + [">{}".format(SERVICE_BINS_US[-1])]
+        print("ch   count errors  service time histogram [us]: " + " ".join("{:>7s}".format(e) for e in edges))
+        for channel in range(len(self.fds)):
+            if self.counts[channel] > 0:
+                print("{:2d} {:7d} {:6d}                               ".format(channel, self.counts[channel], self.errors[channel]) +
+                      " ".join("{:7d}".format(n) for n in self.service_hist[channel]))
+
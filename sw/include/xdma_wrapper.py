@@ -7,12 +7,19 @@ In the future, ChimeraTK-deviceaccess should do this natively.
 
 import mmap
 import os
+import select
 import struct
 import subprocess
 import numpy as np
 
 NUMBER_OF_IRQ_CHANNELS=16
 AXI_LITE_MEM_SIZE=0x1000000 # in bytes
+DAQ_CHANNELS=16 # interleaved 16 bit SEQUENCE_n channels per DAQ sample
+
+def alloc_aligned(n_bytes):
+    # page aligned buffer (anonymous mmap) as target for DMA reads
+    buf = mmap.mmap(-1, max(int(n_bytes), 1))
+    return np.frombuffer(buf, np.uint8, int(n_bytes))
 
 class xdma_wrapper():
     def __init__(self, slot_number):
@@ -50,24 +57,72 @@ class xdma_wrapper():
         self.mem[addr_w_o : addr_w_o + 4] = bs
 
     def read_bytes(self, addr, length):
-        bs = b""
-        for i in range(0, length // 4):
-            addr_w_o = addr + 4 * i
-            b = self.mem[addr_w_o : addr_w_o + 4]
-            bs += b
+        bs = self.read_block(addr, length // 4).tobytes()
         return np.array([bs[0:length]])
 
+    # Block access to the AXI-Lite area. struct.unpack_from/pack_into in native
+    # mode run a C loop over the mmap with one 32 bit load/store per word; unlike a
+    # plain memcpy of the slice this never issues wider or byte-wise accesses,
+    # which the AXI-Lite bridge does not accept.
+    def read_block(self, addr, n_words):
+        # n_words consecutive 32 bit registers starting at addr
+        words = struct.unpack_from("{}I".format(n_words), self.mem, addr)
+        return np.array(words, dtype=np.uint32)
+
+    def write_block(self, addr, data):
+        # write an array of 32 bit words (signed values are stored as two's complement)
+        words = (np.asarray(data, dtype=np.int64).ravel() & 0xFFFFFFFF).tolist()
+        struct.pack_into("{}I".format(len(words)), self.mem, addr, *words)
+
+    def gather(self, addr, n, stride=4):
+        # n 32 bit words spaced stride bytes apart (e.g. one field of a register array)
+        if n <= 0:
+            return np.empty(0, np.uint32)
+        fmt = "I{}x".format(stride - 4) * (n - 1) + "I" if stride > 4 else "{}I".format(n)
+        return np.array(struct.unpack_from(fmt, self.mem, addr), dtype=np.uint32)
+
+    def gather_regions(self, regions):
+        # read several register arrays, given as (addr, n_words) pairs,
+        # e.g. BSP.CLK_FREQ, APP.CNT_EVENTS and DAQ.DAQ_TIMES_0; returns one array per region
+        return [self.read_block(addr, n) for addr, n in regions]
+
     def read_dma(self, addr, len_bytes):
         os.lseek(self.fd_c2h0, addr, os.SEEK_SET)
         dma_raw = os.read(self.fd_c2h0, len_bytes)
         data = np.frombuffer(dma_raw, np.uint8)
         return data
 
+    def read_dma_into(self, addr, buf):
+        # DMA read of len(buf) bytes straight into buf (no intermediate bytes object)
+        view = memoryview(buf).cast("B")
+        done = 0
+        while done < len(view):
+            n = os.preadv(self.fd_c2h0, [view[done:]], addr + done)
+            if n <= 0:
+                raise IOError("DMA read at 0x{:08X} returned {}".format(addr + done, n))
+            done += n
+        return done
+
+    def read_daq_buffer(self, addr, samples, out=None):
+        # Read a multiplexed DAQ buffer (e.g. MEM_MULTIPLEXED_DAQ_CTRL_BUF0) into out,
+        # a preallocated (samples x DAQ_CHANNELS) int16 array (allocated page aligned if None).
+        # The sample-interleaved memory layout is exactly that array, so no copy is needed.
+        if out is None:
+            out = alloc_aligned(samples * DAQ_CHANNELS * 2).view(np.int16).reshape(samples, DAQ_CHANNELS)
+        self.read_dma_into(addr, out)
+        return out
+
     def write_dma(self, addr, data):
         os.lseek(self.fd_h2c0, addr, os.SEEK_SET)
         os.write(self.fd_h2c0, data.tobytes())
 
-    def wait_irq(self, irq_channel):
+    def wait_irq(self, irq_channel, timeout=None):
         # Blocks the code until interrupt is asserted from the FPGA
+        # (or until timeout [s] has passed: returns False in that case)
+        if timeout is not None:
+            ready, _, _ = select.select([self.fd_irq[irq_channel]], [], [], timeout)
+            if not ready:
+                return False
         os.read(self.fd_irq[irq_channel],4)
+        return True
 
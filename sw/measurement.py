@@ -0,0 +1,372 @@
+import os
+import time
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+import doFFT
+from envelope import envelope
+from resultstore import ResultWriter, load_results
+from sweepgrid import SweepAxis, SweepGrid
+
+# Measurement classes shared by the GUI (gui.py) and the command line (cli.py);
+# nothing here needs a display, matplotlib, scipy or PIL at import time.
+
+TS = 8e-9               # sampling constant: a sample every 8ns
+FIRST, LAST = 100, 800  # analysed samples of each pulse (also post.py)
+
+
+#
+#
+#
+class SweepClass:
+
+  def __init__(self, start, stop, step, dc, fc, ps, rc=None):
+    self.start = start
+    self.stop  = stop
+    self.step  = step
+    self.dc    = dc
+    self.fc    = fc
+    self.ps    = ps
+    self.rc    = rc
+    self.nmax = 100
+    # further axes of the sweep besides the power level; None: not swept
+    ## TODO: fields in GUI
+    self.vdds  = [32]    # np.linspace(7,32,num=5)
+    self.vgg1s = [2.2]   # np.linspace(1.5, 2.2,num=3)
+    self.vgg2s = [1.8]   # np.linspace(1.0, 1.8,num=3)
+    self.ref_levels = None
+    self.att_vals   = None
+    # adaptive refinement of the power level: largest change of the results between
+    # neighbouring levels, e.g. {'ad': 0.5, 'pd': 2.0}; None: plain grid
+    self.refine_tol = None
+    self.min_step   = 100
+    # IF [Hz] of the analysed channels: amplitude/phase of that frequency only (single-bin DFT);
+    # None: maximum of the full FFT
+    self.if_freq = 5e6
+    self.filename ="results/sweep.npz"
+    self.store_traces = True  # keep the raw traces of every step next to the scalars
+    self.timing = {}  # stage -> list of durations [s] of the last sweep
+
+  def add_time(self, stage, t0):
+    self.timing.setdefault(stage, []).append(time.perf_counter() - t0)
+
+  def print_timing(self):
+    print("{:10s} {:>6s} {:>10s} {:>10s}".format("stage", "n", "mean[ms]", "total[s]"))
+    for stage, dts in self.timing.items():
+      print("{:10s} {:6d} {:10.1f} {:10.2f}".format(stage, len(dts), 1e3*np.mean(dts), np.sum(dts)))
+  
+  def setSSS(self, start, stop, step):
+    self.start = start
+    self.stop  = stop
+    self.step  = step
+  
+
+  ###########################################################################################
+  # The sweep runs over the axes of sweep_axes() (see sweepgrid): the expensive supply
+  # settings change least often and only when their values change, and with refine_tol
+  # set the power level is refined adaptively where amplitude or phase change quickly.
+  # The sweep is pipelined: the hardware stages (supply, FFD table, acquisition) run in
+  # this thread, the analysis and storage of a step run in a worker thread meanwhile,
+  # i.e. they overlap with the hardware setup of the next step.
+  # Every step is appended to the result directory next to self.filename (see resultstore);
+  # with resume=True the steps completed by an interrupted sweep are skipped.
+  def sweep_axes(self):
+    def timed(stage, fn):
+      def setter(**values):
+        t0 = time.perf_counter()
+        fn(**values)
+        self.add_time(stage, t0)
+      return setter
+    def set_level(Powerlevel):
+      self.fc.setLevel(Powerlevel)
+      self.fc.update()
+    def set_ref_level(Reflevel):
+      self.rc.setLevel(Reflevel)
+      self.rc.update()
+    def set_att(ATT_VAL):
+      self.dc.device.device_write("RTM", "ATT_VAL", ATT_VAL)
+    supply = timed("supply", self.ps.setVddVgg1Vgg2)
+    axes = [SweepAxis("Powerlevel", np.arange(self.start, self.stop+1, self.step), timed("table", set_level), cost=0.05),
+            SweepAxis("Vdd",  self.vdds,  supply, cost=1.0),
+            SweepAxis("Vgg1", self.vgg1s, supply, cost=1.0),
+            SweepAxis("Vgg2", self.vgg2s, supply, cost=1.0)]
+    if self.ref_levels is not None:
+      axes.append(SweepAxis("Reflevel", self.ref_levels, timed("table", set_ref_level), cost=0.05))
+    if self.att_vals is not None:
+      axes.append(SweepAxis("ATT_VAL", self.att_vals, timed("att", set_att), cost=0.001))
+    return axes
+
+  def run_sweep(self, resume=False):
+    from tqdm import tqdm
+    f = doFFT.doFFTClass(TS, freq=self.if_freq)
+    self.timing = {}
+    if self.start<self.stop:
+      t_sweep = time.perf_counter()
+      worker = ThreadPoolExecutor(max_workers=1)  # one worker keeps results in order
+      print("Sweep from", self.start, "to", self.stop, "in steps of", self.step)
+
+      grid = SweepGrid(self.sweep_axes(), refine="Powerlevel" if self.refine_tol else None,
+                       tolerances=self.refine_tol, periods={'pd': 360.0}, min_step=self.min_step)
+      columns = ['t'] + grid.names + ['i_amp', 'i_pha', 'o_amp', 'o_pha', 'ad', 'pd']
+      writer = ResultWriter(os.path.splitext(self.filename)[0], columns, resume=resume)
+      done = []
+      if writer.completed() > 0:
+        print("Resuming after", writer.completed(), "completed steps")
+        X, _, _ = load_results(writer.path)
+        done = [dict(zip(columns, row)) for row in X]
+      # progress over the initial grid; refinement passes extend the total
+      progress = tqdm(total=max(grid.size(), len(done)), initial=len(done), unit="step")
+
+      # analysis of one step (worker thread)
+      def analyse(t, point, alldata):
+        t0 = time.perf_counter()
+        # gather data
+        # Ch1,  Ch2/Output,  Ch3/Input,  Ch7.VM, Ch8/reference
+        #_data = (alldata[:1200,0], alldata[0:1200,1], alldata[0:1200,2], alldata[0:1200,6], alldata[0:1200, 7])  
+        # channel 3 (input) and channel 2 (output), differences output - input
+        r = f.getAP_batch(alldata[FIRST:LAST, [2, 1]].T, reference=0)
+        (i_amplitude, o_amplitude), (i_phase, o_phase) = r["amp"], r["pha"]
+        ad, pd = r["amp_diff"][1], r["pha_diff"][1]
+        print(", ".join("{}: {}".format(k, v) for k, v in point.items()), 'diff:', ad, pd)
+        row = dict(point, t=t, i_amp=i_amplitude, i_pha=i_phase, o_amp=o_amplitude, o_pha=o_phase, ad=ad, pd=pd)
+        self.add_time("analyse", t0)
+        t0 = time.perf_counter()
+        traces = alldata[:1200][:, [0, 1, 2, 6, 7]] if self.store_traces else None
+        writer.append(row, traces)
+        self.add_time("store", t0)
+        return row
+
+      # acquisition of one step (this thread), the grid has applied the settings;
+      # waits for a DAQ buffer captured with them
+      def measure(t, point):
+        t0 = time.perf_counter()
+        alldata = self.dc.update_next()
+        self.add_time("acquire", t0)
+        if t >= progress.total:
+          progress.total = t + 1
+        progress.update(1)
+        return worker.submit(analyse, t, point, alldata)
+
+      try:
+        grid.run(measure, done)
+      finally:
+        worker.shutdown(wait=True)
+        writer.close()
+        progress.close()
+      # export in the former formats once at the end
+      X, columns, traces = load_results(writer.path)
+      _list = [dict(zip(columns[1:-2], row[1:-2])) for row in X]
+      try:
+        np.savez_compressed(self.filename,a=_list)
+        np.savetxt('result.csv',X,delimiter=",")
+      except:
+        print("An error occured while saving.")
+      self.ps.off() # switch supply unit off after sweep to avoid overheating
+      print("Sweep finished; {:.1f} s".format(time.perf_counter() - t_sweep))
+      grid.print_stats()
+      self.print_timing()
+      print("---------------")
+     ###########################################################################################
+  
+  def test_sweep(self, nmax):
+    from tqdm import tqdm
+    f = doFFT.doFFTClass(TS, freq=self.if_freq)
+    # set voltages
+    _level = 20811
+    _vdd = 32.0
+    _vgg1 = 2.2
+    _vgg2 = 1.8
+    self.ps.setVddVgg1Vgg2(Vdd=_vdd,Vgg1=_vgg1, Vgg2 = _vgg2)
+    self.fc.setLevel(_level)
+    self.fc.update()
+
+    time.sleep(1)
+
+    # nmax = 10
+    # channel 3 (input) and channel 2 (output) of every pulse, analysed at once afterwards
+    windows = np.zeros((nmax, 2, LAST - FIRST))
+    n = 0
+    try:
+      for t in tqdm(range(nmax)):
+        alldata = self.dc.update()
+        windows[t] = alldata[FIRST:LAST, [2, 1]].T
+        n = t + 1
+    except:
+      print('test aborted')
+    r = f.getAP_batch(windows[:n], reference=0)
+    X = np.zeros((nmax, 1+2+2+2) )
+    X[:n, 0] = np.arange(n)
+    X[:n, 1:5] = np.column_stack([r["amp"][:, 0], r["pha"][:, 0], r["amp"][:, 1], r["pha"][:, 1]])
+    X[:n, 5] = r["amp_diff"][:, 1]
+    X[:n, 6] = r["pha_diff"][:, 1]
+    np.savetxt('results/results_fixed_pl'+str(_level)+'.csv',X,delimiter=",")
+    print("Power level:", _level)
+    print("amp diff (mean, STD):",np.mean(X[:,5]), np.std(X[:,5]))
+    print("pha diff (mean, STD):",np.mean(X[:,6]), np.std(X[:,6]))
+    self.ps.off() # switch supply unit off after sweep to avoid overheating
+
+
+
+
+
+
+
+
+
+
+#
+#
+#
+class DataClass:
+  # envelope of the 8 ADC channels: mode "max" (running maximum over the
+  # previous `window` samples) or "hilbert" (analytic signal magnitude)
+  def __init__(self,device, window=100, mode="max"):
+    self.device = device
+    self.window = window
+    self.mode   = mode
+    self.lock   = threading.RLock()  # device access from the acquisition thread and the GUI
+    self.data = device.read_daq()
+    self.update_envelope()
+    self.offi = 0
+    self.offq =0
+
+
+  # read a DAQ buffer (read(): the buffer, default dev4.read_daq) and its envelope
+  def update(self, read=None):
+    with self.lock:
+      t0 = time.perf_counter()
+      self.data = read() if read is not None else self.device.read_daq()
+      t1 = time.perf_counter()
+      self.update_envelope()
+      self.t_read    = t1 - t0
+      self.t_process = time.perf_counter() - t1
+      return self.data
+
+  # read a buffer captured after this call (e.g. with the settings of a sweep step just
+  # written), instead of the one completed before them. The finished buffer is read
+  # while double buffering keeps running (read_daq_inactive), into a new array: the
+  # sweep analyses it in a worker thread while the next step is acquired, so it cannot
+  # live in a recycled stream_daq pool slot.
+  def update_next(self, timeout=1.0):
+    with self.lock:
+      if not self.device.wait_daq(2, timeout):
+        print("*** no new DAQ buffer within", timeout, "s")
+      def read():
+        frame = self.device.read_daq_inactive()
+        if frame["torn"]:
+          print("*** the DAQ switched buffers during the read, the data may be mixed")
+        return frame["data"]
+      return self.update(read)
+
+  def update_envelope(self):
+    self.envelope = np.array(self.data, dtype=np.float64)
+    self.envelope[:,:8] = envelope(self.data[:,:8], self.window, self.mode)
+
+
+
+
+
+
+
+#
+#
+#
+class RefClass:
+  def __init__(self,device):
+    self.device = device
+    self.n = 1024
+    self.t = np.arange(self.n)
+    self.i = np.zeros(self.n)
+    self.q = np.zeros(self.n)
+    self.start= 1
+    self.stop = 800
+    self.level = 500
+    self.switch = 795
+    self.i[self.start: self.switch] = self.level
+    self.i[self.switch: self.stop] = -self.level
+    device.update_ref_table(ref_i=self.i, ref_q=self.q)
+
+  def updateRef(self, start, stop, level, switch):
+    self.i = np.zeros(self.n)
+    self.q = np.zeros(self.n)
+    self.start  = start
+    self.stop   = stop
+    self.level  = level
+    self.switch = switch
+    self.i[self.start: self.switch] = self.level
+    self.i[self.switch: self.stop] =  -self.level
+    self.device.update_ref_table(ref_i=self.i, ref_q=self.q)
+
+  def update(self):
+    self.i = np.zeros(self.n)
+    self.q = np.zeros(self.n)
+    self.i[self.start: self.switch] = self.level
+    self.i[self.switch: self.stop] = -self.level
+    self.device.update_ref_table(ref_i=self.i, ref_q=self.q)
+
+
+  def setStart(self, start):
+    self.start = start
+
+  def setStop(self, stop):
+    self.stop = stop
+
+  def setLevel(self, level):
+    self.level = level
+
+  def setSwitch(self, switch):
+    self.switch = switch
+
+
+
+
+#
+# class with the feedforward signals 
+#  
+class FfdClass:
+  def __init__(self,device):
+    self.device = device
+    self.n = 1024
+    self.t = np.arange(self.n)
+    self.i = np.zeros(self.n)
+    self.q = np.zeros(self.n)
+    self.start  = 1
+    self.stop   = 800
+    self.level  = 1024
+    self.switch = 790
+    self.i[self.start: self.switch] = self.level
+    self.i[self.switch: self.stop]  = - self.level
+    device.update_ffd_table(ffd_i=self.i,  ffd_q=self.q)
+
+
+  def updateFfd(self, start, stop, level, switch):
+    self.i = np.zeros(self.n)
+    self.q = np.zeros(self.n)
+    self.start  = start
+    self.stop   = stop
+    self.level  = level
+    self.switch = switch
+    self.i[self.start: self.switch] = self.level
+    self.i[self.switch: self.stop] = -self.level
+    self.device.update_ffd_table(ffd_i=self.i, ffd_q=self.q)
+
+  def update(self):
+    self.i = np.zeros(self.n)
+    self.q = np.zeros(self.n)
+    self.i[self.start: self.switch] = self.level
+    self.i[self.switch: self.stop] =  -self.level
+    self.device.update_ffd_table(ffd_i=self.i, ffd_q=self.q)
+
+
+  def setStart(self, start):
+    self.start = start
+
+  def setStop(self, stop):
+    self.stop = stop
+
+  def setLevel(self, level):
+    self.level = level
+
+  def setSwitch(self, switch):
+    self.switch = switch
@@ -1,59 +1,126 @@
+import time
+import argparse
 import numpy as np
-from scipy.fft import fft, fftfreq
-import matplotlib.pyplot as plt
-
-class SignalClass:
-  def __init__(self, s, pulse):
-    self.I=np.zeros(len(s))
-    self.Q=np.zeros(len(s))
-    self.N=len(s)
-    self.T=1/125_000_000
-    self.s = s
-    self.pulse=pulse
-
-  def process(self,level):
-    iff = 5_000_000
-    self.fft = fft(self.s)
-    self.fftfreq = fftfreq(self.N, d=self.T)
-
-    _in   = np.where(self.fftfreq==iff)[0][0]
-    _fft  = self.fft[_in]
-    __fft = fft(self.pulse)[_in]
-    #_fft1 = "{:e}".format(np.abs(_fft))
-    _fft1 = "{:e}".format(np.max(self.s))
-    _fft2 = "{:e}".format(np.angle(_fft))
-    #_fft3 = "{:e}".format(np.abs(__fft))
-    _fft3 = "{:e}".format(np.max(self.pulse))
-    _fft4 = "{:e}".format(np.angle(__fft))
-    _pd = np.angle(__fft) - np.angle(_fft)
-    if _pd>0: _pd -= 2*np.pi
-    _fft5 = "{:e}".format(np.min([_pd, _pd]))
-    #_fft6 = "{:e}".format(np.abs(__fft) - np.abs(_fft))
-    _fft6 = "{:e}".format(np.max(self.s) - np.max(self.pulse))
-    print("Ch.3 (a, ph):",_fft3,_fft4 , " Ch.2 (a,ph): "+_fft1+" , "+_fft2, ", a diff:",_fft6,", ph diff: "+_fft5)
-    res.append([level, np.max(self.pulse), np.angle(__fft), np.max(self.s), np.angle(_fft), np.max(self.s)-np.max(self.pulse), _pd])
-
-    #plt.plot(self.fftfreq, (2.0/self.N)*np.abs(self.fft),'-x')
-    #plt.grid()
-    #plt.xlabel('Frequency')
-    #plt.ylabel('|.|')
-    #plt.title("Signal " + str(i) + ", length: " + str(self.N))
-    #plt.show()
-
-  def getIQ(self):
-    return self.I, self.Q
-
-############# main ##########################
-#data = np.loadtxt('results/sweep_4july2023d.csv', delimiter=',')
-data = np.load('results/sweep_7juli2023__powerlevel_sspa.csv.npz')['a']
-nmax = data.shape[0]
-#print("Nmax: ", nmax)
-sc = []
-res = []
-for i in range(nmax):
-  #print("Length:", len(data[i,:800,1]))
-  sc.append(SignalClass(data[i,:800,1], data[i,:800,2]))
-  level = 10000+i*1000
-  print("Level:", level)
-  sc[i].process(level)
-np.savetxt('results/sweep_powerlevel_sspa.csv', res, delimiter=',')
+
+import doFFT
+from measurement import TS, FIRST, LAST
+from resultstore import load_results
+
+#
+# Post-processing of a power level sweep: AM/AM and AM/PM of the amplifier from the
+# stored traces, for all levels in one vectorized pass, e.g.
+#   python post.py results/sweep_7juli2023__powerlevel_sspa.csv.npz --start 10000 --step 1000
+#   python post.py results/sweep               (result directory of SweepClass.run_sweep)
+# Input: a (levels x samples x channels) array ('a' of a .npz, a .npy, or the traces of
+# a ResultWriter directory, whose levels are taken from its Powerlevel column). In both
+# layouts channel 1 is the amplifier output and channel 2 the input. Samples
+# FIRST..LAST of each pulse are analysed, as in run_sweep.
+# Output: one row per level: level, input amplitude/phase, output amplitude/phase,
+# gain [dB] (AM/AM), output - input phase in [0, 360) and the AM/PM, i.e. that phase
+# relative to the lowest level in [-180, 180) [deg]; amplitudes as getAP.
+# A result directory swept over further axes (Vdd, ...) gives one curve per setting of
+# them: their values follow the level in each row, the rows are sorted by them and the
+# level, and the AM/PM is relative to the lowest level of the same setting.
+#
+
+COLUMNS = ['level', 'i_amp', 'i_pha', 'o_amp', 'o_pha', 'gain_db', 'pd', 'am_pm']
+
+
+# (levels x samples x channels) array, the levels (None if not stored) and the values
+# of the further swept axes, name -> value per row (only axes with several values)
+def load_sweep(path):
+  if path.endswith(".npz"):
+    return np.load(path)['a'], None, {}
+  if path.endswith(".npy"):
+    return np.load(path, mmap_mode="r"), None, {}
+  scalars, columns, traces = load_results(path)
+  if traces is None:
+    raise ValueError(path + ": no traces stored (sweep with --no-traces)")
+  # columns of run_sweep: t, the grid axes, the results from i_amp on
+  names = columns[1:columns.index('i_amp')] if 'i_amp' in columns else []
+  levels = scalars[:, columns.index('Powerlevel')] if 'Powerlevel' in columns else None
+  others = {}
+  for name in names:
+    values = scalars[:, columns.index(name)]
+    if name != 'Powerlevel' and len(np.unique(values)) > 1:
+      others[name] = values
+  return traces, levels, others
+
+
+# amplitude and phase at the IF of input and output for all levels; the levels are
+# processed in chunks, so memory stays bounded for memory-mapped sweeps of any length.
+# reference: row of the AM/PM reference for every row (default: row 0)
+def amam_ampm(data, f, first=FIRST, last=LAST, reference=0, output=1, input=2, chunk=4096):
+  nlev = data.shape[0]
+  res = np.empty((nlev, len(COLUMNS) - 1))
+  for i in range(0, nlev, chunk):
+    windows = np.asarray(data[i:i+chunk, first:last])[:, :, [input, output]]
+    r = f.getAP_batch(windows.transpose(0, 2, 1), reference=0)
+    res[i:i+chunk, 0:2] = np.stack([r["amp"][:, 0], r["pha"][:, 0]], axis=-1)
+    res[i:i+chunk, 2:4] = np.stack([r["amp"][:, 1], r["pha"][:, 1]], axis=-1)
+    res[i:i+chunk, 5] = r["pha_diff"][:, 1]
+  with np.errstate(divide="ignore", invalid="ignore"):
+    res[:, 4] = 20*np.log10(res[:, 2] / res[:, 0])
+  res[:, 6] = doFFT.wrap_phase(res[:, 5] - res[reference, 5], -180.0)
+  return res
+
+
+# order of the rows by the further axes, then the level, and for every row the row of
+# the lowest level with the same values of the further axes
+def curves(levels, others):
+  settings = np.column_stack([np.zeros((len(levels), 0))] + list(others.values()))
+  order = np.lexsort([levels] + list(others.values())[::-1])
+  reference = np.empty(len(levels), dtype=int)
+  _, group = np.unique(settings, axis=0, return_inverse=True)
+  group = group.reshape(-1)
+  for g in np.unique(group):
+    rows = order[group[order] == g]
+    reference[rows] = rows[0]
+  return order, reference
+
+
+# one curve per setting of the further axes (the nothers columns after the level)
+def plot(table, nothers=0):
+  import matplotlib.pyplot as plt
+  fig, ax = plt.subplots(2, 1, sharex=True)
+  settings = table[:, 1:1+nothers]
+  for s in np.unique(settings, axis=0):
+    rows = np.all(settings == s, axis=1)
+    res = table[rows, 1+nothers:]
+    label = ", ".join("{:g}".format(v) for v in s) or None
+    ax[0].plot(res[:, 0], res[:, 2], '-x', label=label)
+    ax[1].plot(res[:, 0], res[:, 6], '-x')
+  if nothers:
+    ax[0].legend()
+  ax[0].set_ylabel('output amplitude')
+  ax[0].grid()
+  ax[1].set_xlabel('input amplitude')
+  ax[1].set_ylabel('AM/PM [deg]')
+  ax[1].grid()
+  plt.show()
+
+
+parser = argparse.ArgumentParser(description="AM/AM and AM/PM of a power level sweep")
+parser.add_argument("input", nargs="?", default="results/sweep_7juli2023__powerlevel_sspa.csv.npz",
+                    help=".npz/.npy array (levels x samples x channels) or result directory")
+parser.add_argument("-o", "--output", default="results/sweep_powerlevel_sspa.csv")
+parser.add_argument("--start", type=float, default=10000, help="first level, if not stored")
+parser.add_argument("--step",  type=float, default=1000, help="level step, if not stored")
+parser.add_argument("--first", type=int, default=FIRST, help="first analysed sample of each pulse")
+parser.add_argument("--last",  type=int, default=LAST, help="end of the analysed samples of each pulse")
+parser.add_argument("--if-freq", type=float, default=5e6)
+parser.add_argument("--plot", action="store_true", help="show the AM/AM and AM/PM curves")
+args = parser.parse_args()
+
+t0 = time.perf_counter()
+data, levels, others = load_sweep(args.input)
+if levels is None:
+  levels = args.start + args.step*np.arange(data.shape[0])
+order, reference = curves(levels, others)
+res = amam_ampm(data, doFFT.doFFTClass(TS, freq=args.if_freq), args.first, args.last, reference)
+table = np.column_stack([levels] + list(others.values()) + [res])[order]
+header = COLUMNS[:1] + list(others) + COLUMNS[1:]
+np.savetxt(args.output, table, delimiter=',', fmt='%.6g', header=','.join(header), comments='')
+print(len(table), "levels ->", args.output, "in {:.2f} s".format(time.perf_counter() - t0))
+if args.plot:
+  plot(table, len(others))
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+#
+# Incremental rendering of one FigureCanvasTkAgg: the line artists are created once
+# (animated, so a normal draw leaves them out) and updated with set_data. The static
+# part (axes, grid, ticks) is rendered only when needed and cached as background;
+# a data update restores the background, draws the lines and blits the figure.
+#
+class BlitCanvas:
+  def __init__(self, canvas, lines):
+    self.canvas = canvas
+    self.lines  = lines
+    self.background = None
+    self.dirty = True     # static part must be rendered again (new limits, first draw)
+    self.stale = False    # lines changed but not yet shown (e.g. hidden tab)
+    for line in lines:
+      line.set_animated(True)
+    canvas.mpl_connect("draw_event", self.on_draw)
+
+  # every full draw (also resize, zoom, pan) renews the background
+  def on_draw(self, event):
+    self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+    self.draw_lines()
+
+  def draw_lines(self):
+    for line in self.lines:
+      line.axes.draw_artist(line)
+
+  # new data for line k; the axes limits are only changed (full redraw) if the
+  # data leaves them or uses less than a quarter of the y-range
+  def set_line(self, k, y, x=None):
+    line = self.lines[k]
+    if x is None:
+      x = np.arange(len(y))
+    line.set_data(x, y)
+    ax = line.axes
+    if len(y) == 0:
+      return
+    ymin, ymax = float(np.min(y)), float(np.max(y))
+    lo, hi = ax.get_ylim()
+    span = max(ymax - ymin, 1e-12)
+    if ymin < lo or ymax > hi or span < 0.25*(hi - lo):
+      ax.set_ylim(ymin - 0.05*span, ymax + 0.05*span)
+      self.dirty = True
+    if (x[0], x[-1]) != tuple(ax.get_xlim()):
+      ax.set_xlim(x[0], x[-1] if x[-1] > x[0] else x[0] + 1)
+      self.dirty = True
+    self.stale = True
+
+  # show the current data: full draw if the static part changed, otherwise blit
+  def refresh(self):
+    if self.dirty or self.background is None:
+      self.dirty = False
+      self.canvas.draw()
+    else:
+      self.canvas.restore_region(self.background)
+      self.draw_lines()
+      self.canvas.blit(self.canvas.figure.bbox)
+    self.stale = False
@@ -0,0 +1,116 @@
+import json
+import os
+import numpy as np
+
+
+#
+# Append-only, crash-safe storage of sweep results. A result directory holds
+#   header.json  column names and trace shape/dtype (written once, atomically)
+#   scalars.bin  one float64 record per completed step
+#   traces.bin   optional raw traces, one fixed-size record per step
+# Every step appends one record to each file (traces first, so a scalar record
+# marks a complete step) and is flushed to disk. The cost per step is constant,
+# and after a crash only the interrupted step is lost: partial records are cut
+# off when the directory is opened again, and completed() tells where to resume.
+# With resume=False earlier results in the directory are discarded.
+#
+class ResultWriter:
+  def __init__(self, path, columns=None, resume=True):
+    self.path = path
+    os.makedirs(path, exist_ok=True)
+    header_file = os.path.join(path, "header.json")
+    if not resume:
+      for name in ("header.json", "scalars.bin", "traces.bin"):
+        if os.path.exists(os.path.join(path, name)):
+          os.remove(os.path.join(path, name))
+    if os.path.exists(header_file):
+      with open(header_file) as f:
+        self.header = json.load(f)
+      if columns is not None and list(columns) != self.header["columns"]:
+        raise ValueError("columns differ from the existing results in " + path)
+    else:
+      if columns is None or len(columns) == 0:
+        raise ValueError("no results in " + path + ": the columns of a new result directory are required")
+      self.header = {"columns": list(columns), "trace_shape": None, "trace_dtype": None}
+      self.write_header()
+    self.columns = self.header["columns"]
+    self.n = self.truncate()
+    self.fs = open(os.path.join(path, "scalars.bin"), "ab")
+    self.ft = None
+
+  def write_header(self):
+    tmp = os.path.join(self.path, "header.json.tmp")
+    with open(tmp, "w") as f:
+      json.dump(self.header, f)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(self.path, "header.json"))
+
+  def trace_bytes(self):
+    if self.header["trace_shape"] is None:
+      return 0
+    return int(np.prod(self.header["trace_shape"])) * np.dtype(self.header["trace_dtype"]).itemsize
+
+  # number of complete steps; partial records of an interrupted write are removed
+  def truncate(self):
+    scalar_bytes = 8*len(self.columns)
+    fs = os.path.join(self.path, "scalars.bin")
+    ft = os.path.join(self.path, "traces.bin")
+    n = os.path.getsize(fs) // scalar_bytes if os.path.exists(fs) else 0
+    if self.trace_bytes() > 0:
+      n = min(n, os.path.getsize(ft) // self.trace_bytes() if os.path.exists(ft) else 0)
+      if os.path.exists(ft):
+        os.truncate(ft, n*self.trace_bytes())
+    if os.path.exists(fs):
+      os.truncate(fs, n*scalar_bytes)
+    return n
+
+  def completed(self):
+    return self.n
+
+  # append one step: row with one value per column (sequence or dict), optional traces array
+  def append(self, row, traces=None):
+    if isinstance(row, dict):
+      row = [row[c] for c in self.columns]
+    record = np.asarray(row, dtype=np.float64)
+    if len(record) != len(self.columns):
+      raise ValueError("expected {} values, got {}".format(len(self.columns), len(record)))
+    if traces is not None:
+      traces = np.ascontiguousarray(traces)
+      if self.header["trace_shape"] is None:
+        self.header["trace_shape"] = list(traces.shape)
+        self.header["trace_dtype"] = traces.dtype.str
+        self.write_header()
+      if list(traces.shape) != self.header["trace_shape"]:
+        raise ValueError("trace shape {} differs from {}".format(traces.shape, self.header["trace_shape"]))
+      if self.ft is None:
+        self.ft = open(os.path.join(self.path, "traces.bin"), "ab")
+      self.ft.write(traces.astype(self.header["trace_dtype"], copy=False).tobytes())
+      self.ft.flush()
+      os.fsync(self.ft.fileno())
+    self.fs.write(record.tobytes())
+    self.fs.flush()
+    os.fsync(self.fs.fileno())
+    self.n += 1
+
+  def close(self):
+    self.fs.close()
+    if self.ft is not None:
+      self.ft.close()
+
+
+# read a result directory: scalars (steps x columns), column names, traces (steps x shape) or None
+def load_results(path):
+  with open(os.path.join(path, "header.json")) as f:
+    header = json.load(f)
+  ncol = len(header["columns"])
+  scalars = np.fromfile(os.path.join(path, "scalars.bin"), dtype=np.float64)
+  scalars = scalars[:len(scalars)//ncol*ncol].reshape(-1, ncol)
+  traces = None
+  if header["trace_shape"] is not None and os.path.exists(os.path.join(path, "traces.bin")):
+    traces = np.memmap(os.path.join(path, "traces.bin"), dtype=np.dtype(header["trace_dtype"]), mode="r")
+    size = int(np.prod(header["trace_shape"]))
+    n = min(len(traces)//size, len(scalars))
+    traces = traces[:n*size].reshape([n] + header["trace_shape"])
+    scalars = scalars[:n]
+  return scalars, header["columns"], traces
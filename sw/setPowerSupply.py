@@ -3,7 +3,11 @@ import time
 
 
 class setPowerSupplyClass:
-    def __init__(self):
+    # client: an already connected socket-like object (e.g. include.sim.sim_supply) instead of the supply
+    def __init__(self, client=None):
+        if client is not None:
+            self.client = client
+            return
         #create an INET, STREAMing socket (IPv4, TCP/IP)
         try:
             self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
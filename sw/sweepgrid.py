@@ -0,0 +1,152 @@
+import itertools
+import numpy as np
+
+
+#
+# One axis of a sweep: the values to visit and the setter applying a value.
+# cost is the rough duration of one change in seconds (supply settling, table
+# upload, register write); the most expensive axes are swept outermost so they
+# change least often. Axes sharing a setter (e.g. the three supply voltages of
+# setVddVgg1Vgg2) are applied with one call, setter(**values of the group).
+#
+class SweepAxis:
+  def __init__(self, name, values, setter, cost=0.0):
+    self.name   = name
+    self.values = list(np.atleast_1d(values).tolist())
+    self.setter = setter
+    self.cost   = cost
+
+
+#
+# N-dimensional sweep over a set of axes.
+#  - Points are visited in snake (boustrophedon) order with the expensive axes
+#    outermost: between two consecutive points only one axis changes, and a
+#    setter is only called when one of its values really changes.
+#  - Optional adaptive refinement of the axis `refine`: after a pass, the
+#    midpoint of every pair of neighbouring points whose results differ by more
+#    than `tolerances` (result key -> allowed change, with `periods` giving the
+#    period of phase-like keys) is measured in a further pass, until no interval
+#    is too coarse, the interval reaches `min_step` or `max_passes` is reached.
+# A coarse grid with refinement needs far fewer acquisitions than a dense grid.
+#
+class SweepGrid:
+  def __init__(self, axes, refine=None, tolerances=None, periods=None, min_step=None, max_passes=4):
+    self.names      = [a.name for a in axes]                # declared order
+    self.axes       = sorted(axes, key=lambda a: -a.cost)   # outermost first
+    self.refine     = refine
+    self.tolerances = tolerances or {}
+    self.periods    = periods or {}
+    self.min_step   = min_step
+    self.max_passes = max_passes
+    self.current    = {}   # values last applied to the hardware
+    self.last       = {}   # last point visited (measured or resumed)
+    self.changes    = {a.name: 0 for a in axes}
+    self.calls      = 0
+    self.passes     = []   # number of points measured per pass
+
+  # points of the initial grid in snake order: digit k runs backwards whenever the
+  # linear index of the digits outside of it is odd
+  def points(self):
+    sizes = [len(a.values) for a in self.axes]
+    for idx in itertools.product(*[range(n) for n in sizes]):
+      point = {}
+      prefix = 0
+      for axis, i, n in zip(self.axes, idx, sizes):
+        point[axis.name] = axis.values[n-1-i if prefix % 2 else i]
+        prefix = prefix*n + i
+      yield point
+
+  # number of points of the initial grid
+  def size(self):
+    return int(np.prod([len(a.values) for a in self.axes]))
+
+  # apply a point, calling each setter only if one of its values changed
+  def apply(self, point):
+    done = []
+    for axis in self.axes:
+      if axis.setter in done:
+        continue
+      group = [a for a in self.axes if a.setter is axis.setter]
+      changed = [a.name for a in group if self.current.get(a.name) != point[a.name]]
+      if changed:
+        axis.setter(**{a.name: point[a.name] for a in group})
+        self.calls += 1
+        for name in changed:
+          self.changes[name] += 1
+          self.current[name] = point[name]
+      done.append(axis.setter)
+
+  # change of a result between neighbours, phase-like keys wrapped into +-period/2
+  def difference(self, key, a, b):
+    d = b[key] - a[key]
+    if key in self.periods:
+      p = self.periods[key]
+      d = (d + p/2) % p - p/2
+    return abs(d)
+
+  # midpoints of the intervals along the refine axis where a result changes too much
+  def midpoints(self, results):
+    others = [n for n in self.names if n != self.refine]
+    lines = {}
+    for point, result in results:
+      lines.setdefault(tuple(point[n] for n in others), []).append((point[self.refine], result))
+    new = []
+    for key, line in lines.items():
+      line.sort(key=lambda x: x[0])
+      for (x0, r0), (x1, r1) in zip(line[:-1], line[1:]):
+        if not any(self.difference(k, r0, r1) > tol for k, tol in self.tolerances.items()):
+          continue
+        if self.min_step is not None and x1 - x0 < 2*self.min_step:
+          continue
+        mid = (x0 + x1)//2 if isinstance(x0, int) and isinstance(x1, int) else (x0 + x1)/2
+        if mid in (x0, x1):
+          continue
+        point = dict(zip(others, key))
+        point[self.refine] = mid
+        new.append(point)
+    # keep the slow axes together, starting at the end where the hardware is now
+    new.sort(key=lambda p: [p[a.name] for a in self.axes])
+    slow = [a.name for a in self.axes if a.name != self.refine]
+    if new and [new[-1][n] for n in slow] == [self.last.get(n) for n in slow]:
+      new.reverse()
+    return new
+
+  # measure(index, point) returns the result dict of a point, or a future of it
+  # (e.g. from a worker thread); futures are resolved at the end of each pass so
+  # the analysis can overlap with the next points. The results of the first
+  # len(done) points are taken from `done` (resume of an interrupted sweep); axis
+  # values stored in a done row must equal those of its point, otherwise the sweep
+  # differs from the interrupted one and a ValueError is raised.
+  # Returns the list of (point, result) in measurement order.
+  def run(self, measure, done=()):
+    results = []
+    batch = list(self.points())
+    for npass in range(self.max_passes + 1):
+      pending = []
+      for point in batch:
+        index = len(results) + len(pending)
+        if index < len(done):
+          stored = {n: done[index][n] for n in self.names if n in done[index]}
+          if any(stored[n] != point[n] for n in stored):
+            raise ValueError("step {}: stored {} differs from {} of this sweep; resume with the "
+                             "settings of the interrupted sweep".format(index,
+                               ", ".join("{}={}".format(n, stored[n]) for n in stored),
+                               ", ".join("{}={}".format(n, point[n]) for n in stored)))
+          pending.append((point, done[index]))
+        else:
+          self.apply(point)
+          pending.append((point, measure(index, point)))
+        self.last = point
+      for point, result in pending:
+        results.append((point, result.result() if hasattr(result, "result") else result))
+      self.passes.append(len(batch))
+      if self.refine is None or npass == self.max_passes:
+        break
+      batch = self.midpoints(results)
+      if not batch:
+        break
+    return results
+
+  def print_stats(self):
+    print("points per pass:", self.passes, "total:", sum(self.passes), "(initial grid:", self.size(), ")")
+    print("setter calls:", self.calls, "changes:", self.changes)
@@ -9,24 +9,13 @@ Xs = [X[i] for i in range(len(X)) if (X[i]['Vdd'] == 32.0) and (X[i]['Vgg1']==2.
 X = Xs
 
 fft = doFFTClass(ts)
-pd = []
-ad = []
-re = np.zeros((201,3))
+# input: channel 3 (index 2), output: channel 2 (index 1); all records in one call
+r = fft.getAP_batch(np.array([[x['data'][2], x['data'][1]] for x in X]), reference=0)
+ad = r["amp_diff"][:, 1]
+pd = r["pha_diff"][:, 1]
+re = np.column_stack([[x['Powerlevel'] for x in X], ad, pd])
 for i in range(len(X)):
-    #fft.plotFFT(inputsignal)
-    inputsignal = X[i]['data'][2]
-    outputsignal = X[i]['data'][1]
-    mfreq, ia, ip = fft.getAP(inputsignal)
-    mfreq, oa, op = fft.getAP(outputsignal)
-    ad.append(oa-ia)
-    pd1 =  op-ip
-    if pd1<0:
-        pd1 +=360 # 2*np.pi
-    pd.append(pd1)
-    print(i, "power:", X[i]['Powerlevel'],"Amp.diff:", oa-ia, "Pha.diff:", pd1)
-    re[i,0] = X[i]['Powerlevel']
-    re[i,1] = oa-ia
-    re[i,2] = pd1 
+    print(i, "power:", X[i]['Powerlevel'],"Amp.diff:", ad[i], "Pha.diff:", pd[i])
 
 print("Average amplitude difference:", np.mean(ad))
 print("STD     amplitude difference:", np.std(ad))
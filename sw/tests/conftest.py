@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the sw modules are run from sw/ (python gui.py, cli.py, ...), not installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from demod import Demodulator
+
+ts = 8e-9
+f_if = 5e6
+
+
+# IF tone with an amplitude step from 1000 to 2000 at sample `step`, phase `pha` [rad]
+def tone(n, step, pha=0.3):
+  k = np.arange(n)
+  amp = np.where(k < step, 1000.0, 2000.0)
+  return amp * np.cos(2*np.pi*f_if*ts*k + pha)
+
+
+@pytest.mark.parametrize("decimation, order, tol", [(25, 1, 1e-6), (25, 2, 1e-6), (25, 3, 1e-6),
+                                                    (32, 3, 2.0), (20, 4, 2.0)])
+def test_amplitude_phase_and_timing(decimation, order, tol):
+  step = 5013
+  d = Demodulator(ts, f_if, decimation=decimation, order=order)
+  r = d.process(tone(16384, step))
+  t, amp, pha = r["t"], r["amp"][:, 0], r["pha"][:, 0]
+  # no ramp-up at the start: the first block already has the full amplitude
+  assert len(t) == 16384 // decimation - (order - 1)
+  # settled far from the step: amplitude and phase of the tone
+  width = order * decimation * ts
+  before, after = t < step*ts - width, t > step*ts + width
+  assert np.all(np.abs(amp[before] - 1000.0) < tol)
+  assert np.all(np.abs(amp[after] - 2000.0) < 2*tol)
+  assert np.all(np.abs(pha[before | after] - np.degrees(0.3)) < 0.2)
+  # timing: the step response is symmetric about the step, so the area of the
+  # amplitude trace gives the time of the step; the same as the plain block average
+  # over whole IF periods (uncompensated, the cascade lags by (order-1)*(decimation-1)/2
+  # samples)
+  assert abs(step_time(r) - step*ts) < 4*ts
+  single = Demodulator(ts, f_if, decimation=25, order=1).process(tone(16384, step))
+  assert abs(step_time(r) - step_time(single)) < ts
+
+
+# time of the step 1000 -> 2000 from the area under the amplitude trace
+def step_time(r):
+  t, amp = r["t"], r["amp"][:, 0]
+  block = t[1] - t[0]
+  return t[-1] + block/2 - block * np.sum((amp - 1000.0) / 1000.0)
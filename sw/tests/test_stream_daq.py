@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from dev4 import dev4
+
+
+# simulated board triggering every `period` s, as after init_board with that trigger_rate
+@pytest.fixture
+def board(monkeypatch):
+  monkeypatch.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+  d = dev4(backend="sim")
+  d.trigger_rate = 0.05
+  d.device_write("TIMING", "DIVIDER_VALUE", int(d.app_clk_freq * d.trigger_rate) - 1, 0)
+  d.device_write("DAQ", "DOUBLE_BUF_ENA", 1, 0)
+  return d
+
+
+def frames(d, n, **kwargs):
+  return [dict(f, data=None) for f in d.stream_daq(n, **kwargs)]
+
+
+# buffers completed between the frames and not read (0 unless the test machine is slow)
+def skipped(got):
+  return [0] + [(g["pulse_id"] - f["pulse_id"] - 1) % 2**32 for f, g in zip(got[:-1], got[1:])]
+
+
+def test_skipped_buffers_are_missed(board):
+  got = frames(board, 5)
+  assert [f["missed"] for f in got] == skipped(got)
+  assert got[-1]["pool"].stats["missed"] == sum(skipped(got))
+
+
+def test_triggers_in_one_buffer_are_missed(board):
+  sim = board.xdma
+  advance = sim.advance
+  def several_triggers():
+    advance()
+    for buf in (0, 1):
+      sim.set("DAQ.TRG_CNT_BUF{}".format(buf), 3)
+  sim.advance = several_triggers
+  got = frames(board, 4)
+  assert [f["trg_cnt"] for f in got] == [3] * 4
+  assert [f["missed"] for f in got] == [2 + n for n in skipped(got)]
+
+
+def test_timestamp_gap_is_missed(board):
+  # the start times advance by two of the periods dev4 expects per buffer: every other
+  # trigger completed no buffer
+  board.trigger_rate /= 2
+  got = frames(board, 4)
+  assert [f["missed"] for f in got] == [0] + [1 + 2*n for n in skipped(got)[1:]]
+
+
+def test_separate_pools(board):
+  streams = [board.stream_daq(hold=True), board.stream_daq(hold=True)]
+  a, b = next(streams[0]), next(streams[1])
+  assert a["pool"] is not b["pool"]
+  # a frame of the first stream goes back to its own pool, not to the second one
+  free = len(b["pool"].free)
+  board.release_frame(a)
+  assert len(b["pool"].free) == free and a["slot"] in a["pool"].free
+
+
+def test_polling_without_xdma(board):
+  # registers and buffers still through the mapped device, but no xDMA device for
+  # interrupts: the default use_irq falls back to polling INACTIVE_BUF_ID
+  board.xdma = None
+  with pytest.raises(RuntimeError):
+    board.read_daq_irq(0.1)
+  got = frames(board, 3)
+  assert [f["missed"] for f in got] == skipped(got)
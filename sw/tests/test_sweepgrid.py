@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from sweepgrid import SweepAxis, SweepGrid
+
+
+class Recorder:
+  # setters of a fake board: every call is recorded with its arguments
+  def __init__(self):
+    self.calls = []
+    self.state = {}
+
+  def setter(self, name):
+    def set(**values):
+      self.calls.append((name, values))
+      self.state.update(values)
+    return set
+
+
+def test_snake_order_expensive_axes_outermost():
+  rec = Recorder()
+  grid = SweepGrid([SweepAxis('level', [10, 20, 30], rec.setter('level'), cost=0.01),
+                    SweepAxis('vdd', [1, 2], rec.setter('vdd'), cost=2.0)])
+  points = [(p['vdd'], p['level']) for p in grid.points()]
+  assert points == [(1, 10), (1, 20), (1, 30), (2, 30), (2, 20), (2, 10)]
+
+
+def test_one_axis_changes_between_neighbours():
+  grid = SweepGrid([SweepAxis('a', [0, 1, 2], None, cost=3),
+                    SweepAxis('b', [0, 1], None, cost=2),
+                    SweepAxis('c', [0, 1, 2, 3], None, cost=1)])
+  points = list(grid.points())
+  assert len(points) == grid.size() == 24
+  assert len({tuple(sorted(p.items())) for p in points}) == 24
+  for p, q in zip(points[:-1], points[1:]):
+    assert sum(p[k] != q[k] for k in p) == 1
+
+
+def test_grouped_setter_called_once_per_change():
+  rec = Recorder()
+  supply = rec.setter('supply')
+  axes = [SweepAxis('Vdd', [7, 32], supply, cost=1.0),
+          SweepAxis('Vgg1', [2.2], supply, cost=1.0),
+          SweepAxis('Vgg2', [1.5, 1.8], supply, cost=1.0),
+          SweepAxis('Powerlevel', [1000, 2000, 3000], rec.setter('level'), cost=0.01)]
+  grid = SweepGrid(axes)
+  results = grid.run(lambda t, point: dict(rec.state))
+  n = len(results)
+  assert n == 12
+  # the three supply voltages always arrive together, in one call per supply change
+  supply_calls = [v for name, v in rec.calls if name == 'supply']
+  assert all(sorted(v) == ['Vdd', 'Vgg1', 'Vgg2'] for v in supply_calls)
+  assert len(supply_calls) == 4       # 2 x 1 x 2 supply settings, each applied once
+  assert len([c for c in rec.calls if c[0] == 'level']) == n - 4 + 1
+  assert grid.calls == len(rec.calls)
+  assert grid.changes == {'Vdd': 2, 'Vgg1': 1, 'Vgg2': 3, 'Powerlevel': n - 4 + 1}
+  # every measurement saw the settings of its point
+  for point, state in results:
+    assert state == point
+
+
+# a known curve: flat, a steep step around x = 55, flat; phase wrapping at 360
+def curve(x):
+  return {'y': np.tanh((x - 55) / 2.0), 'p': (359.8 + 0.4 * np.tanh((x - 20) / 5.0)) % 360.0}
+
+
+def refined_grid(min_step=1, futures=False):
+  rec = Recorder()
+  grid = SweepGrid([SweepAxis('x', list(range(0, 101, 10)), rec.setter('x'))], refine='x',
+                   tolerances={'y': 0.1, 'p': 1.0}, periods={'p': 360.0}, min_step=min_step, max_passes=10)
+  if futures:
+    with ThreadPoolExecutor(max_workers=1) as worker:
+      return grid, grid.run(lambda t, point: worker.submit(curve, rec.state['x']))
+  return grid, grid.run(lambda t, point: curve(rec.state['x']))
+
+
+def test_refinement_against_known_curve():
+  grid, results = refined_grid()
+  xs = sorted(p['x'] for p, r in results)
+  assert len(xs) == len(set(xs))
+  # far fewer points than the dense grid at min_step
+  assert len(xs) < 30
+  # only the step is refined; the wrap of p at 360 deg is no change
+  assert all(x % 10 == 0 for x in xs if x < 45 or x > 65)
+  # every interval is fine enough or at the minimum step
+  line = sorted((p['x'], r['y']) for p, r in results)
+  for (x0, y0), (x1, y1) in zip(line[:-1], line[1:]):
+    assert abs(y1 - y0) <= 0.1 or x1 - x0 < 2
+  assert grid.passes[0] == 11 and sum(grid.passes) == len(results)
+
+
+def test_refinement_with_futures_and_resume():
+  grid, results = refined_grid(futures=True)
+  assert [p for p, r in results] == [p for p, r in refined_grid()[1]]
+  # resume after 15 steps: those are replayed, not measured again
+  rec = Recorder()
+  measured = []
+  def measure(t, point):
+    measured.append(t)
+    return curve(rec.state['x'])
+  resumed = SweepGrid([SweepAxis('x', list(range(0, 101, 10)), rec.setter('x'))], refine='x',
+                      tolerances={'y': 0.1, 'p': 1.0}, periods={'p': 360.0}, min_step=1, max_passes=10)
+  again = resumed.run(measure, done=[r for p, r in results[:15]])
+  assert measured == list(range(15, len(results)))
+  assert [p for p, r in again] == [p for p, r in results]
+  assert all(r == s for (p, r), (q, s) in zip(again, results))
+
+
+def test_resume_rejects_other_sweep():
+  grid, results = refined_grid()
+  # rows as stored by run_sweep: the axis values next to the results
+  done = [dict(p, **r) for p, r in results[:15]]
+  again = refined_grid()[0].run(lambda t, point: curve(point['x']), done=done)
+  assert [p for p, r in again] == [p for p, r in results]
+  # a different grid (other step) must not take over the stored results
+  other = SweepGrid([SweepAxis('x', list(range(0, 101, 20)), None)], refine='x',
+                    tolerances={'y': 0.1, 'p': 1.0}, periods={'p': 360.0}, min_step=1)
+  with pytest.raises(ValueError):
+    other.run(lambda t, point: curve(point['x']), done=done)
+  # a different refinement: the first midpoint of the first refinement pass differs
+  coarse = SweepGrid([SweepAxis('x', list(range(0, 101, 10)), None)], refine='x',
+                     tolerances={'y': 0.5, 'p': 1.0}, periods={'p': 360.0}, min_step=1)
+  with pytest.raises(ValueError):
+    coarse.run(lambda t, point: curve(point['x']), done=[dict(p, **r) for p, r in results])
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+
+import numpy as np
+import pytest
+
+from include.xdma_irq import irq_dispatcher, SERVICE_BINS_US
+
+
+# pipes as event channels, 4 byte events as from /dev/xdma/slotN/eventsX
+def fire(w, n=1):
+    os.write(w, n.to_bytes(4, "little"))
+
+
+def test_callbacks_and_counts():
+    async def main():
+        pipes = [os.pipe() for i in range(2)]
+        dispatcher = irq_dispatcher([r for r, w in pipes])
+        dispatcher.start()
+        calls = []
+        dispatcher.on_irq(1, lambda channel, t: calls.append((channel, t)))
+        for i in range(3):
+            fire(pipes[1][1])
+            await asyncio.sleep(0.01)
+        dispatcher.stop()
+        return dispatcher, calls
+
+    dispatcher, calls = asyncio.run(main())
+    assert [c for c, t in calls] == [1, 1, 1]
+    assert [t for c, t in calls] == sorted(t for c, t in calls)
+    assert dispatcher.counts.tolist() == [0, 3]
+    assert dispatcher.last_time[0] is None
+    assert dispatcher.last_time[1] == calls[-1][1]
+
+
+def test_wait_resolves_on_its_channel_only():
+    async def main():
+        pipes = [os.pipe() for i in range(2)]
+        dispatcher = irq_dispatcher([r for r, w in pipes])
+        dispatcher.start()
+        waiter = asyncio.ensure_future(dispatcher.wait(0))
+        await asyncio.sleep(0)
+        fire(pipes[1][1])
+        await asyncio.sleep(0.01)
+        pending = not waiter.done()
+        fire(pipes[0][1])
+        t = await asyncio.wait_for(waiter, 1.0)
+        dispatcher.stop()
+        return dispatcher, pending, t
+
+    dispatcher, pending, t = asyncio.run(main())
+    assert pending
+    assert t == dispatcher.last_time[0]
+    assert dispatcher.counts.tolist() == [1, 1]
+
+
+def test_eventfd_counts_accumulated_events():
+    async def main():
+        fd = os.eventfd(0, os.EFD_NONBLOCK)
+        dispatcher = irq_dispatcher([fd], read_size=8)
+        dispatcher.start()
+        os.eventfd_write(fd, 5)   # five events before the loop gets to read them
+        await asyncio.sleep(0.01)
+        dispatcher.stop()
+        os.close(fd)
+        return dispatcher
+
+    dispatcher = asyncio.run(main())
+    assert dispatcher.counts.tolist() == [5]
+    assert dispatcher.service_hist.sum() == 1   # one read serviced all five
+
+
+def test_service_histogram(capsys):
+    async def main():
+        r, w = os.pipe()
+        dispatcher = irq_dispatcher([r])
+        dispatcher.start()
+        # a slow callback lands in a bin above 2 ms
+        dispatcher.on_irq(0, lambda channel, t: time.sleep(0.003))
+        for i in range(4):
+            fire(w)
+            await asyncio.sleep(0.01)
+        dispatcher.stop()
+        return dispatcher
+
+    dispatcher = asyncio.run(main())
+    hist = dispatcher.service_hist[0]
+    assert hist.shape == (len(SERVICE_BINS_US) + 1,)
+    assert hist.sum() == 4
+    assert hist[:np.searchsorted(SERVICE_BINS_US, 2000) + 1].sum() == 0
+    dispatcher.print_stats()
+    assert capsys.readouterr().out.splitlines()[1].split()[:2] == ["0", "4"]
+
+
+def test_raising_callback_keeps_dispatching(capsys):
+  async def main():
+    r, w = os.pipe()
+    dispatcher = irq_dispatcher([r])
+    dispatcher.start()
+    calls = []
+    def broken(channel, t):
+      raise ValueError("broken callback")
+    dispatcher.on_irq(0, broken)
+    dispatcher.on_irq(0, lambda channel, t: calls.append(t))
+    waiter = asyncio.ensure_future(dispatcher.wait(0))
+    await asyncio.sleep(0)
+    fire(w)
+    t = await asyncio.wait_for(waiter, 1.0)
+    dispatcher.stop()
+    return dispatcher, calls, t
+
+  dispatcher, calls, t = asyncio.run(main())
+  assert calls == [t]
+  assert dispatcher.errors.tolist() == [1]
+  assert dispatcher.service_hist.sum() == 1
+  assert "broken callback" in capsys.readouterr().out
+
+
+def test_wait_before_start():
+  async def main():
+    r, w = os.pipe()
+    dispatcher = irq_dispatcher([r])
+    with pytest.raises(RuntimeError, match="start"):
+      await dispatcher.wait(0)
+
+  asyncio.run(main())
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from include.xdma_wrapper import xdma_wrapper
+
+
+# the block access of an xdma_wrapper on a plain buffer instead of the mapped BAR
+@pytest.fixture
+def xw():
+  w = xdma_wrapper.__new__(xdma_wrapper)
+  w.mem = bytearray(np.arange(64, dtype=np.uint32).tobytes())
+  return w
+
+
+@pytest.mark.parametrize("stride", [4, 8, 12])
+def test_gather(xw, stride):
+  assert xw.gather(8, 5, stride).tolist() == list(range(2, 2 + 5*stride//4, stride//4))
+  assert xw.gather(8, 1, stride).tolist() == [2]
+
+
+@pytest.mark.parametrize("stride", [4, 8])
+def test_gather_nothing(xw, stride):
+  for n in (0, -1):
+    words = xw.gather(8, n, stride)
+    assert words.dtype == np.uint32 and words.shape == (0,)